@@ -0,0 +1,235 @@
+import asyncio
+import csv
+import hashlib
+from datetime import datetime, date, timedelta
+from calendar_batch import CalendarBatch, MAX_BATCH_SIZE
+from event_store import get_event_store
+
+# Batches of imports allowed in flight at once during an import
+MAX_CONCURRENT_BATCHES = 4
+
+
+def _unescape(value):
+    """Undo RFC 5545 TEXT escaping."""
+    return value.replace("\\n", "\n").replace("\\N", "\n").replace("\\,", ",").replace("\\;", ";").replace("\\\\", "\\")
+
+
+# Parses ICS content lines (already unfolded, see ingest.UploadReader) into Google event bodies, one VEVENT at a time
+class IcsParser:
+    def __init__(self, time_zone):
+        """
+        :param time_zone: ZoneInfo used for floating times that carry no TZID.
+        """
+        self.time_zone = time_zone
+        self.event = None  # properties of the VEVENT being read
+        self.depth = 0  # nesting inside the VEVENT (VALARM blocks etc. are skipped)
+
+    def _time(self, params, value):
+        if params.get("VALUE") == "DATE" or len(value) == 8:
+            return {"date": datetime.strptime(value[:8], "%Y%m%d").date().isoformat()}
+        if value.endswith("Z"):
+            return {"dateTime": datetime.strptime(value, "%Y%m%dT%H%M%SZ").isoformat() + "Z"}
+        return {
+            "dateTime": datetime.strptime(value, "%Y%m%dT%H%M%S").isoformat(),
+            "timeZone": params.get("TZID", self.time_zone.key),
+        }
+
+    def feed(self, record):
+        """
+        :param record: One content line.
+        :return: A Google event body when the record closes a VEVENT, otherwise None.
+        """
+        name_params, _, value = record.partition(":")
+        name, *raw_params = name_params.split(";")
+        name = name.upper()
+        params = dict(param.partition("=")[::2] for param in raw_params)
+
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and self.event is None:
+                self.event = {"recurrence": []}
+            elif self.event is not None:
+                self.depth += 1
+            return None
+        if name == "END" and self.event is not None:
+            if self.depth:
+                self.depth -= 1
+                return None
+            event, self.event = self.event, None
+            return self._body(event)
+        if self.event is None or self.depth:
+            return None
+
+        if name in ("DTSTART", "DTEND"):
+            self.event[name] = self._time(params, value)
+        elif name in ("RRULE", "EXRULE", "RDATE", "EXDATE"):
+            self.event["recurrence"].append(record)
+        elif name in ("SUMMARY", "LOCATION", "DESCRIPTION", "UID"):
+            self.event[name] = _unescape(value)
+        return None
+
+    def _body(self, event):
+        if "DTSTART" not in event:
+            return None
+        start = event["DTSTART"]
+        end = event.get("DTEND")
+        if end is None:  # RFC 5545: no end means one day for dates, zero length for times
+            end = {"date": (date.fromisoformat(start["date"]) + timedelta(days=1)).isoformat()} if "date" in start else dict(start)
+        body = {"summary": event.get("SUMMARY", "No Title"), "start": start, "end": end}
+        if event.get("LOCATION"):
+            body["location"] = event["LOCATION"]
+        if event.get("DESCRIPTION"):
+            body["description"] = event["DESCRIPTION"]
+        if event["recurrence"]:
+            body["recurrence"] = event["recurrence"]
+            # Recurring events need an explicit zone to expand in, UTC times don't carry one
+            for moment in (start, end):
+                if "dateTime" in moment:
+                    moment.setdefault("timeZone", "UTC")
+        body["iCalUID"] = event.get("UID") or make_ical_uid(body)
+        return body
+
+
+# Parses CSV rows into Google event bodies. Understands simple (summary, start, end) files and Google Calendar's CSV export.
+class CsvParser:
+    def __init__(self, time_zone):
+        """
+        :param time_zone: ZoneInfo for times without an offset.
+        """
+        self.time_zone = time_zone
+        self.header = None
+
+    def _time(self, day, time_of_day=None):
+        if time_of_day:
+            for fmt in ("%I:%M %p", "%H:%M", "%I:%M:%S %p", "%H:%M:%S"):
+                try:
+                    time_of_day = datetime.strptime(time_of_day.strip(), fmt).time()
+                    break
+                except ValueError:
+                    continue
+            else:
+                raise ValueError(f"Unrecognized time: {time_of_day}")
+        day = day.strip()
+        for fmt in ("%m/%d/%Y", "%Y-%m-%d"):
+            try:
+                parsed_day = datetime.strptime(day, fmt).date()
+                break
+            except ValueError:
+                continue
+        else:  # full ISO timestamp in a single column
+            moment = datetime.fromisoformat(day)
+            if moment.tzinfo:
+                return {"dateTime": moment.isoformat()}
+            return {"dateTime": moment.isoformat(), "timeZone": self.time_zone.key}
+        if time_of_day is None:
+            return {"date": parsed_day.isoformat()}
+        return {"dateTime": datetime.combine(parsed_day, time_of_day).isoformat(), "timeZone": self.time_zone.key}
+
+    def feed(self, record):
+        """
+        :param record: One CSV line. The first line is the header.
+        :return: A Google event body, or None for the header and blank lines.
+        """
+        if not record.strip():
+            return None
+        row = next(csv.reader([record]))
+        if self.header is None:
+            self.header = [column.strip().lower() for column in row]
+            return None
+        row = dict(zip(self.header, row))
+
+        summary = row.get("summary") or row.get("subject") or row.get("title") or "No Title"
+        all_day = row.get("all day event", "").strip().lower() == "true"
+        if "start" in row:
+            start, end = self._time(row["start"]), self._time(row.get("end") or row["start"])
+        else:
+            start = self._time(row["start date"], None if all_day else row.get("start time"))
+            end = self._time(row.get("end date") or row["start date"], None if all_day else row.get("end time"))
+        if "date" in end and end == start:  # all-day end dates are exclusive
+            end = {"date": (date.fromisoformat(start["date"]) + timedelta(days=1)).isoformat()}
+
+        body = {"summary": summary, "start": start, "end": end}
+        if row.get("location"):
+            body["location"] = row["location"]
+        if row.get("description"):
+            body["description"] = row["description"]
+        body["iCalUID"] = row.get("uid") or row.get("ical uid") or make_ical_uid(body)
+        return body
+
+
+def make_ical_uid(body):
+    """Stable iCalUID for records that don't carry one, so importing the same file twice doesn't duplicate events."""
+    key = f"{body['summary']}|{body['start']}|{body['end']}"
+    return hashlib.sha1(key.encode("utf-8")).hexdigest() + "@timespace"
+
+
+# Deterministic import of structured files straight into Google Calendar, no LLM involved
+class BulkImporter:
+    def __init__(self, calendar_service, calendar_id='primary'):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService.
+        :param calendar_id: Calendar the events are imported into.
+        """
+        self.calendar_service = calendar_service
+        self.calendar_id = calendar_id
+        self.store = get_event_store(calendar_service, calendar_id)
+
+    async def import_records(self, records):
+        """
+        Parse records as they arrive and import them in batches, skipping events that already exist.
+
+        :param records: Async iterable of records (lines) from an ICS or CSV file.
+        :return: Summary dict with 'imported', 'skipped' and 'failed' (list of error strings) counts.
+        """
+        await self.store.sync()
+        seen = {event.get("iCalUID") for event in self.store.events.values()}
+        summary = {"imported": 0, "skipped": 0, "failed": []}
+        semaphore = asyncio.Semaphore(MAX_CONCURRENT_BATCHES)
+        batches = []
+        pending = []
+        parser = None
+
+        async def import_batch(bodies):
+            async with semaphore:
+                batch = CalendarBatch(self.calendar_service, self.calendar_id)
+                for body in bodies:
+                    batch.import_(body)  # events.insert would drop the iCalUID dedup relies on
+                for result in await batch.execute():
+                    if result["error"]:
+                        summary["failed"].append(f"{result['event']['summary']}: {result['error']}")
+                    else:
+                        self.store.upsert(result["response"])
+                        summary["imported"] += 1
+
+        try:
+            async for record in records:
+                if parser is None:
+                    if not record.strip():
+                        continue
+                    parser = IcsParser(self.store.time_zone) if record.strip().upper() == "BEGIN:VCALENDAR" else CsvParser(self.store.time_zone)
+                try:
+                    body = parser.feed(record)
+                except (ValueError, KeyError) as e:
+                    summary["failed"].append(f"{record}: {e}")
+                    continue
+                if body is None:
+                    continue
+                if body["iCalUID"] in seen:  # already on the calendar, or earlier in this file
+                    summary["skipped"] += 1
+                    continue
+                seen.add(body["iCalUID"])
+                pending.append(body)
+                # Start writing full batches right away instead of waiting for the end of the file
+                if len(pending) == MAX_BATCH_SIZE:
+                    batches.append(asyncio.create_task(import_batch(pending)))
+                    pending = []
+
+            if pending:
+                batches.append(asyncio.create_task(import_batch(pending)))
+            await asyncio.gather(*batches)
+        except BaseException:
+            # Cancelled (DELETE /tasks/{id}) or the upload broke: stop writing batches for a task that's being reported as failed
+            for batch in batches:
+                batch.cancel()
+            await asyncio.gather(*batches, return_exceptions=True)
+            raise
+        return summary
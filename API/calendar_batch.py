@@ -0,0 +1,101 @@
+import asyncio
+import os
+from governor import is_retryable_calendar_error
+
+# Google recommends keeping Calendar batches at 50 calls or fewer
+MAX_BATCH_SIZE = int(os.getenv("CALENDAR_MAX_BATCH_SIZE", 50))
+MAX_BATCH_RETRIES = int(os.getenv("CALENDAR_MAX_BATCH_RETRIES", 3))
+
+# Groups event inserts, imports, updates and deletes into Calendar batch HTTP requests
+class CalendarBatch:
+    def __init__(self, calendar_service, calendar_id='primary', max_batch_size=MAX_BATCH_SIZE, max_retries=MAX_BATCH_RETRIES):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService.
+        :param calendar_id: Calendar every operation in the batch applies to.
+        :param max_batch_size: Maximum number of calls sent in one HTTP request.
+        :param max_retries: How many times items that failed with a retryable error are re-sent.
+        """
+        self.service = calendar_service.service
+        self.calendar = calendar_service.aio
+        self.calendar_id = calendar_id
+        self.max_batch_size = max_batch_size
+        self.max_retries = max_retries
+        self.operations = []
+
+    # Queue operations, each returns the index of the item in the results list
+    def insert(self, event_body):
+        return self._queue("insert", event_body)
+
+    # Unlike insert, keeps the body's iCalUID, so importing the same event again updates it instead of adding a copy
+    def import_(self, event_body):
+        return self._queue("import", event_body)
+
+    def update(self, event_body):
+        return self._queue("update", event_body)
+
+    def delete(self, event_body):
+        return self._queue("delete", event_body)
+
+    def _queue(self, operation, event_body):
+        self.operations.append((operation, event_body))
+        return len(self.operations) - 1
+
+    def _request(self, operation, event_body):
+        events = self.service.events()
+        if operation == "insert":
+            return events.insert(calendarId=self.calendar_id, body=event_body)
+        if operation == "import":
+            return events.import_(calendarId=self.calendar_id, body=event_body)
+        if operation == "update":
+            return events.update(calendarId=self.calendar_id, eventId=event_body['id'], body=event_body)
+        return events.delete(calendarId=self.calendar_id, eventId=event_body['id'])
+
+    async def _send(self, indices, results):
+        """
+        Send one batch HTTP request for the given items and record a result for each one.
+
+        :return: True if the HTTP request failed as a whole, after the governor's own retries.
+        """
+        def callback(request_id, response, exception):
+            results[int(request_id)].update(response=response, error=exception)
+
+        batch = self.service.new_batch_http_request(callback=callback)
+        for index in indices:
+            batch.add(self._request(*self.operations[index]), request_id=str(index))
+        try:
+            await self.calendar.execute(batch, cost=len(indices))
+        except Exception as e:  # The whole HTTP request failed, so every item in it did too
+            for index in indices:
+                results[index].update(response=None, error=e)
+            return True
+        return False
+
+    async def execute(self):
+        """
+        Send every queued operation, using as few HTTP requests as possible, and retry only the items that failed.
+
+        :return: One dict per queued operation, in queue order, with keys 'operation', 'event', 'response' and 'error'.
+                 'error' is None when the item succeeded.
+        """
+        results = [
+            {"operation": operation, "event": event_body, "response": None, "error": None}
+            for operation, event_body in self.operations
+        ]
+        pending = list(range(len(self.operations)))
+
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                await asyncio.sleep(0.5 * 2 ** (attempt - 1))  # back off before re-sending failures
+            chunks = [pending[i:i + self.max_batch_size] for i in range(0, len(pending), self.max_batch_size)]
+            request_failed = await asyncio.gather(*(self._send(chunk, results) for chunk in chunks))
+
+            # Whole-request failures were already retried by the governor, only re-send items the batch response rejected
+            pending = [
+                index for chunk, failed in zip(chunks, request_failed) if not failed for index in chunk
+                if results[index]["error"] is not None and is_retryable_calendar_error(results[index]["error"])
+            ]
+            if not pending:
+                break
+
+        self.operations = []
+        return results
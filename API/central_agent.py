@@ -2,25 +2,59 @@ import json
 import asyncio
 from gcal_scraper import GcalScraper
 from events_initializer import EventInitializer
-from gcal_service import GoogleCalendarService
+from gcal_service import get_calendar_service
 from events_editor import EventEditor  # Import EventEditor to handle event editing
 import google.generativeai as genai
-import textwrap
 from model_initializer import ModelInitializer
+from task_scheduler import TaskScheduler
+from task_router import TaskRouter
+from bulk_import import BulkImporter
+from ingest import UploadReader
+import progress
+from offload import run_cpu
+from prompt_context import events_context
+from fast_path import match_intent, render_events, render_free_times, MIN_FREE_MINUTES
+from datetime import datetime
+import time
 
 
 # Central Agent to manage task assignment and coordinate agents
 class CentralAgent:
-    def __init__(self):
+    def __init__(self, calendar_service=None):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService. Defaults to the process-wide one.
+        """
+        started = time.perf_counter()
         self.input_text = None
 
-        # Instantiate the GoogleCalendarService
-        calendar_service = GoogleCalendarService()
+        # One calendar service shared by every agent
+        calendar_service = calendar_service or get_calendar_service()
+        self.calendar_service = calendar_service
 
-        # Instantiate the GcalScraper using the authenticated calendar service
+        # Instantiate the agents using the authenticated calendar service
         self.gcal_scraper = GcalScraper(calendar_service)
-        self.event_initializer = EventInitializer()  # Initialize EventInitializer for creating events
-        self.event_editor = EventEditor()  # Initialize EventEditor for editing and deleting events
+        self.event_initializer = EventInitializer(calendar_service)  # Initialize EventInitializer for creating events
+        self.event_editor = EventEditor(calendar_service)  # Initialize EventEditor for editing and deleting events
+        self.router = TaskRouter()  # Breaks input down into tasks
+
+        # Model used to answer read queries in paragraph form, shared by fetch_events and fetch_free_times
+        self.responder = ModelInitializer(
+            "You are a calendar assistant. Based on the following input, respond to the query in paragraph form."
+        )
+        print(f"Agents ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    # Build every agent's model up front so the first request doesn't pay for it
+    async def warm_up(self, connect=False):
+        started = time.perf_counter()
+        await asyncio.gather(
+            *(
+                model_init.warm_up(connect)
+                for model_init in (self.router.model_init, self.responder, self.gcal_scraper.model_init, self.event_initializer.model_init, self.event_editor.model_init)
+            ),
+            self.gcal_scraper.load_time_zone(),
+            self.gcal_scraper.store.sync(),
+        )
+        print(f"Agents warmed up in {(time.perf_counter() - started) * 1000:.0f} ms")
 
     # Upload input text that may contain commands for the agent to process
     def upload_input_text(self, input_text):
@@ -31,60 +65,104 @@ class CentralAgent:
         if self.input_text:
             print(f"Input: {self.input_text}")
 
-            # Use Gemini AI to break down the input into tasks
-            task_breakdown_prompt = textwrap.dedent(f"""
-                Break down the tasks given in the following input: "{self.input_text}".
-                Assign these tasks to specific agents based on functionality.
-                Use the GcalScraper for retrieving events, the EventInitializer for scheduling or creating new events, 
-                and the EventEditor for editing or deleting existing events. 
-                Provide a JSON response with each task and the agent responsible. Break it down into task, type, agent, date, and event details.
-            """)
-            
-            # Call Gemini model to generate the task breakdown
-            response = self.event_initializer.model_init.model.generate_content(task_breakdown_prompt)
-
-            # Debug the response before parsing
-            print(f"Raw response from Gemini: {response.text}")
+            # Simple lookups ("what's on my calendar tomorrow") are answered locally, without any model call
+            today = datetime.now(await self.gcal_scraper.load_time_zone()).date()
+            intent = match_intent(self.input_text, today)
+            if intent is not None:
+                return [await self.answer_directly(*intent)]
 
+            # Calendar files are recognized locally, everything else is broken down by Gemini in JSON mode
             try:
-                # Attempt to parse the response as JSON
-                tasks = json.loads(response.text)
-            except json.JSONDecodeError as e:
-                print(f"Failed to parse JSON: {e}")
+                tasks = await self.router.route(self.input_text)
+            except asyncio.TimeoutError:
+                print("Timed out waiting for the task breakdown from Gemini")
                 return
 
             # Debug the parsed tasks
             print(f"Parsed tasks: {tasks}")
+            progress.report("step", {"agent": "CentralAgent", "tasks": tasks})
 
-            # Handle the tasks if parsed successfully
-            await self.handle_tasks(tasks.get("tasks", []))
+            # Handle the tasks if parsed successfully, read tasks return their answers
+            return await self.handle_tasks(tasks)
 
-    # Handle tasks assigned to specific agents
+    # Answer a lookup the fast path recognized from a template
+    async def answer_directly(self, task_type, date):
+        progress.report("step", {"agent": "GcalScraper", "task": {"type": task_type, "date": date}})
+        time_zone = await self.gcal_scraper.load_time_zone()
+        if task_type == "retrieve events":
+            answer = render_events(date, await self.gcal_scraper.get_events_on_date(date), time_zone)
+        else:
+            answer = render_free_times(date, await self.gcal_scraper.free_intervals(date, MIN_FREE_MINUTES), time_zone, 7.0, 22.0)
+        progress.report("chunk", {"type": task_type, "date": date, "text": answer})
+        print("Response:", answer)
+        return answer
+
+    # Handle tasks assigned to specific agents, independent tasks run concurrently
+    # Returns one entry per task: the answer text for read tasks, None for the others, the exception for failed ones
     async def handle_tasks(self, tasks):
-        for task in tasks:
-            print(f"Handling task: {task}")
-            task_type = task.get("type")
-
-            if task_type == "retrieve events":
-                await self.fetch_events(task.get("date"))
-            elif task_type == "retrieve free times":
-                await self.fetch_free_times(task.get("date"))
-            elif task_type == "schedule":
-                await self.create_event(task.get("eventDetails"))
-            elif task_type == "edit":
-                await self.edit_event(task.get("eventDetails"))
-            elif task_type == "unknown task":
-                continue
+        groups = self.group_schedule_tasks(tasks)
+        merged = [tasks[group[0]] if len(group) == 1 else self.merge_schedule_tasks([tasks[i] for i in group]) for group in groups]
+        results = await TaskScheduler(self.handle_task).run(merged)
+        return [result for group, result in zip(groups, results) for _ in group]
+
+    # Runs of consecutive "schedule" tasks (e.g. a series of study sessions) are created with one batch request
+    # Returns lists of task indices, one per task to run
+    @staticmethod
+    def group_schedule_tasks(tasks):
+        groups = []
+        for index, task in enumerate(tasks):
+            if groups and task.get("type") == "schedule" and tasks[groups[-1][-1]].get("type") == "schedule":
+                groups[-1].append(index)
             else:
-                print(f"Unknown task type: {task_type}")
+                groups.append([index])
+        return groups
+
+    @staticmethod
+    def merge_schedule_tasks(tasks):
+        dates = {task.get("date") for task in tasks}
+        return {
+            "task": "; ".join(str(task.get("task")) for task in tasks),
+            "type": "schedule",
+            "agent": tasks[0].get("agent"),
+            "date": dates.pop() if len(dates) == 1 else None,  # spans several days, so it orders against every task
+            "eventDetails": [task.get("eventDetails") for task in tasks],
+        }
+
+    # Route a single task to the agent responsible for it
+    async def handle_task(self, task):
+        print(f"Handling task: {task}")
+        progress.report("step", {"agent": task.get("agent"), "task": task})
+        task_type = task.get("type")
+
+        if task_type == "retrieve events":
+            return await self.fetch_events(task.get("date"))
+        elif task_type == "retrieve free times":
+            return await self.fetch_free_times(task.get("date"))
+        elif task_type == "schedule":
+            if isinstance(task.get("eventDetails"), list):  # merged by handle_tasks
+                await self.create_events(task["eventDetails"])
+            else:
+                await self.create_event(task.get("eventDetails"))
+        elif task_type == "edit":
+            await self.edit_event(task.get("eventDetails"))
+        elif task_type == "import":
+            await self.import_events()
+        elif task_type == "unknown task":
+            return
+        else:
+            print(f"Unknown task type: {task_type}")
 
     # Fetch events from the calendar using GcalScraper
     async def fetch_events(self, date):
         print(f"Fetching events for {date}...")
-        events = self.gcal_scraper.get_events_on_date(date)
+        events = await self.gcal_scraper.get_events_on_date(date)
+        time_zone = await self.gcal_scraper.load_time_zone()
+        events_text, included = events_context(events, time_zone, query=self.input_text)
+        print(f"Sending {included} of {len(events)} events to the model")
         # Use Gemini AI to determine events
         task_breakdown_prompt = f"""
-            Respond to "{self.input_text}" by fetching the day's scheduled events given the following context. The events on the user's calendar are as follows: "{events}".
+            Respond to "{self.input_text}" by fetching the day's scheduled events given the following context. The events on the user's calendar are as follows, one per line:
+            {events_text}
             Here are example responses:
             
             "On {date}, you have a phone call with Sam from 10 AM to 11 AM, a meeting with Julie from 1 PM to 2 PM, and a dinner with family from 6 PM to 8 PM."
@@ -92,28 +170,24 @@ class CentralAgent:
             "The events scheduled for {date} are: a conference from 9 AM to 5 PM, reception from 6 PM to 8 PM, and a party from 8 PM to 11 PM."
         """
         
-        model_init = ModelInitializer(f"""
-            You are a calendar assistant. Based on the following input, respond to the query in paragraph form.
-            """
-        )
-        
-        # Call Gemini model to generate the task breakdown
-        response = model_init.model.generate_content(task_breakdown_prompt)
-        print("Gemini Response:", response)
+        # Call Gemini model, the answer is streamed to the user as it is written
+        answer = await self.respond(task_breakdown_prompt, "retrieve events", date)
         
         if events:
             for event in events:
-                print("Event:", event.get('summary', 'No Title'))
-                print("Start:", event['start'].get('dateTime', 'All-day event'))
-                print("End:", event['end'].get('dateTime', 'All-day event'))
+                start, end = event.datetimes(time_zone)
+                print("Event:", event.summary)
+                print("Start:", 'All-day event' if event.all_day else start.isoformat())
+                print("End:", 'All-day event' if event.all_day else end.isoformat())
                 print()
         else:
             print(f"No events found for {date}")
+        return answer
     
     # Fetch free times using GcalScraper
     async def fetch_free_times(self, date):
         print(f"Fetching free times for {date}...")
-        busy_times = self.gcal_scraper.get_busy_times(date)
+        busy_times = await self.gcal_scraper.get_busy_times(date)
         
         task_breakdown_prompt = f"""
             Respond to "{self.input_text}" by fetching the day's free times given the following context. Do not tell me when I have events scheduled,
@@ -124,49 +198,77 @@ class CentralAgent:
             "The times you are free on {date} are as follows: 10 AM to 11 AM, 1 PM to 3 PM."
         """
         
-        model_init = ModelInitializer(f"""
-            You are a calendar assistant. Based on the following input, respond to the query in paragraph form.
-            """
-        )
-        
-        # Call Gemini model'
-        response = model_init.model.generate_content(task_breakdown_prompt)
-        print("Gemini Response:", response)
+        # Call Gemini model, the answer is streamed to the user as it is written
+        answer = await self.respond(task_breakdown_prompt, "retrieve free times", date)
         
         if busy_times:
             for busy_time in busy_times:
                 print("Busy Time:", busy_time)
         else:
             print(f"No busy times found for {date}")
+        return answer
+
+    # Stream the responder's answer to the task's channel chunk by chunk, and return the whole text
+    async def respond(self, prompt, task_type, date):
+        parts = []
+        async for text in self.responder.stream(prompt, cache=True):
+            parts.append(text)
+            progress.report("chunk", {"type": task_type, "date": date, "text": text})
+        answer = "".join(parts)
+        print("Gemini Response:", answer)
+        return answer
+
+    # Import pasted ICS or CSV content straight into the calendar, no model involved
+    async def import_events(self):
+        async def chunks():
+            yield self.input_text.encode("utf-8")
+
+        summary = await BulkImporter(self.calendar_service).import_records(UploadReader(chunks()).records())
+        print(f"Imported {summary['imported']} events, skipped {summary['skipped']}, {len(summary['failed'])} failed")
 
     # Create an event using EventInitializer and Gemini AI
     async def create_event(self, event_details):
         print("Creating event with details:", event_details)
-        ai_generated_event = json.loads((await self.event_initializer.event_init_ai_server(event_details)).text)
-        self.event_initializer.add_event(ai_generated_event)
+        response_text = (await self.event_initializer.event_init_ai_server(event_details)).text
+        ai_generated_event = await run_cpu(json.loads, response_text, size=len(response_text))
+        await self.event_initializer.add_event(ai_generated_event)
+
+    # Create several events, generated concurrently and inserted with a single batch request
+    async def create_events(self, event_details_list):
+        print(f"Creating {len(event_details_list)} events with details:", event_details_list)
+        responses = await asyncio.gather(
+            *(self.event_initializer.event_init_ai_server(event_details) for event_details in event_details_list),
+            return_exceptions=True
+        )
+        event_bodies = []
+        for event_details, response in zip(event_details_list, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                ai_generated_event = await run_cpu(json.loads, response.text, size=len(response.text))
+            except Exception as e:
+                print(f"Could not generate event for {event_details}: {e}")
+                continue
+            event_bodies.extend(ai_generated_event if isinstance(ai_generated_event, list) else [ai_generated_event])
+        if event_bodies:
+            await self.event_initializer.add_events(event_bodies)
 
     # Edit or delete an event using EventEditor
     async def edit_event(self, event_details):
         print("Editing event with details:", event_details)
 
         # Fetch upcoming events before editing
-        events = self.event_editor.get_events()
+        events = await self.event_editor.get_events()
 
         # Use AI to generate an updated event body
-        event_body = json.loads((await self.event_editor.event_edit_ai_server(event_details, events)).text)
+        response_text = (await self.event_editor.event_edit_ai_server(event_details, events)).text
+        event_body = await run_cpu(json.loads, response_text, size=len(response_text))
 
-        # If the event is cancelled, delete it; otherwise, update the event
+        # Cancelled events are deleted, the rest updated, all in a single batch request
+        if isinstance(event_body, dict):
+            event_body = [event_body]
         if isinstance(event_body, list):
-            for single_event in event_body:
-                if single_event.get('status') == 'cancelled':
-                    self.event_editor.delete_event(single_event)
-                else:
-                    self.event_editor.update_event(single_event)
-        elif isinstance(event_body, dict):
-            if event_body.get('status') == 'cancelled':
-                self.event_editor.delete_event(event_body)
-            else:
-                self.event_editor.update_event(event_body)
+            await self.event_editor.apply_events(event_body)
         else:
             print(f"Unexpected event_body format: {type(event_body)}. Expected list or dict.")
 
@@ -174,6 +276,7 @@ class CentralAgent:
 async def main():
     # Initialize the CentralAgent
     central_agent = CentralAgent()
+    await central_agent.warm_up()
 
     # Simulate uploading input text to the agent
     central_agent.upload_input_text("I have an Analysis midterm on 2024-11-01 at 8 am. Please schedule the midterm and regular study sessions leading up to it.")
@@ -0,0 +1,91 @@
+import hashlib
+import os
+import re
+import threading
+
+# "file" keeps one token file per user (shared by every worker process on the machine), "memory" keeps them in this process only
+CREDENTIAL_STORE = os.getenv("CREDENTIAL_STORE", "file")
+CREDENTIAL_STORE_DIR = os.getenv("CREDENTIAL_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tokens"))
+# The single-user setup's token file, still used for the default user
+DEFAULT_TOKEN_FILE = "token.json"
+DEFAULT_USER = "default"
+
+
+# Interface every credential store implements. Tokens are authorized-user JSON strings, as written by Credentials.to_json()
+class CredentialStore:
+    def load(self, user_id):
+        """:return: The user's token JSON, or None if the user never authorized."""
+        raise NotImplementedError
+
+    def save(self, user_id, token_json):
+        raise NotImplementedError
+
+    def delete(self, user_id):
+        raise NotImplementedError
+
+
+# In-process store, for tests and single-process deployments that receive tokens some other way
+class MemoryCredentialStore(CredentialStore):
+    def __init__(self):
+        self.tokens = {}
+        self._lock = threading.Lock()
+
+    def load(self, user_id):
+        with self._lock:
+            return self.tokens.get(user_id)
+
+    def save(self, user_id, token_json):
+        with self._lock:
+            self.tokens[user_id] = token_json
+
+    def delete(self, user_id):
+        with self._lock:
+            self.tokens.pop(user_id, None)
+
+
+# One JSON file per user in a directory, the default user keeps using token.json in the working directory
+class FileCredentialStore(CredentialStore):
+    def __init__(self, directory=CREDENTIAL_STORE_DIR):
+        self.directory = directory
+
+    def path(self, user_id):
+        if user_id == DEFAULT_USER:
+            return DEFAULT_TOKEN_FILE
+        # User IDs come from request headers, never let them pick the path
+        safe = re.sub(r"[^A-Za-z0-9_.-]", "_", user_id)[:64]
+        return os.path.join(self.directory, f"{safe}-{hashlib.sha1(user_id.encode('utf-8')).hexdigest()[:12]}.json")
+
+    def load(self, user_id):
+        try:
+            with open(self.path(user_id)) as token:
+                return token.read()
+        except FileNotFoundError:
+            return None
+
+    def save(self, user_id, token_json):
+        path = self.path(user_id)
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename, so a concurrent reader never sees half a token
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w") as token:
+            token.write(token_json)
+        os.replace(temporary, path)
+
+    def delete(self, user_id):
+        try:
+            os.remove(self.path(user_id))
+        except FileNotFoundError:
+            pass
+
+
+def create_credential_store(kind=CREDENTIAL_STORE):
+    """
+    :param kind: "file" or "memory".
+    :return: A new credential store of that kind.
+    """
+    if kind == "file":
+        return FileCredentialStore()
+    if kind == "memory":
+        return MemoryCredentialStore()
+    raise ValueError(f"Unknown credential store: {kind}")
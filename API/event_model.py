@@ -0,0 +1,124 @@
+from datetime import datetime
+from zoneinfo import ZoneInfo
+
+
+def parse_datetime(value):
+    """Parse an RFC3339 timestamp as returned by the Calendar API into an aware datetime."""
+    return datetime.fromisoformat(value.replace("Z", "+00:00"))
+
+
+# A span of time in epoch seconds, [start, end)
+class Interval:
+    __slots__ = ("start", "end")
+
+    def __init__(self, start, end):
+        self.start = int(start)
+        self.end = int(end)
+
+    @classmethod
+    def from_datetimes(cls, start, end):
+        return cls(start.timestamp(), end.timestamp())
+
+    @classmethod
+    def from_iso(cls, period):
+        """:param period: Dict with 'start' and 'end' RFC3339 strings, as in freebusy results and find_times output."""
+        return cls(parse_datetime(period["start"]).timestamp(), parse_datetime(period["end"]).timestamp())
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+    def overlaps(self, start, end):
+        return self.start < end and self.end > start
+
+    def datetimes(self, time_zone):
+        """:return: (start, end) as aware datetimes in the given timezone."""
+        return datetime.fromtimestamp(self.start, time_zone), datetime.fromtimestamp(self.end, time_zone)
+
+    def to_iso(self, time_zone):
+        """:return: Dict with 'start' and 'end' ISO strings in the given timezone, the shape find_times returns."""
+        start, end = self.datetimes(time_zone)
+        return {"start": start.isoformat(), "end": end.isoformat()}
+
+    def __iter__(self):  # start, end = interval
+        yield self.start
+        yield self.end
+
+    def __eq__(self, other):
+        return isinstance(other, Interval) and (self.start, self.end) == (other.start, other.end)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.start}, {self.end})"
+
+
+# What the agents need to know about an event, parsed once from the Google event dict
+class Event(Interval):
+    __slots__ = ("id", "summary", "location", "all_day", "busy", "recurring", "cancelled")
+
+    def __init__(self, start, end, id=None, summary="No Title", location=None, all_day=False, busy=True, recurring=False, cancelled=False):
+        super().__init__(start, end)
+        self.id = id
+        self.summary = summary
+        self.location = location
+        self.all_day = all_day
+        self.busy = busy  # blocks time the way freebusy counts it
+        self.recurring = recurring
+        self.cancelled = cancelled
+
+    @staticmethod
+    def _moment(value, time_zone):
+        if "dateTime" in value:
+            moment = parse_datetime(value["dateTime"])
+            if moment.tzinfo is None:  # bodies we built ourselves may carry the zone separately
+                moment = moment.replace(tzinfo=ZoneInfo(value["timeZone"]) if value.get("timeZone") else time_zone)
+            return moment
+        # All-day events span midnight to midnight in the calendar's timezone
+        return datetime.fromisoformat(value["date"]).replace(tzinfo=time_zone)
+
+    @classmethod
+    def from_google(cls, event, time_zone):
+        """
+        :param event: Event resource (or body) as used by the Calendar API.
+        :param time_zone: The calendar's ZoneInfo, for all-day events and times without an offset.
+        """
+        # Mirror freebusy: transparent events and invitations the user declined don't block time
+        declined = any(
+            attendee.get("self") and attendee.get("responseStatus") == "declined" for attendee in event.get("attendees", [])
+        )
+        return cls(
+            cls._moment(event["start"], time_zone).timestamp(),
+            cls._moment(event["end"], time_zone).timestamp(),
+            id=event.get("id"),
+            summary=event.get("summary", "No Title"),
+            location=event.get("location"),
+            all_day="date" in event["start"],
+            busy=event.get("transparency") != "transparent" and not declined,
+            recurring=bool(event.get("recurringEventId") or event.get("recurrence")),
+            cancelled=event.get("status") == "cancelled",
+        )
+
+    def to_google_times(self, time_zone):
+        """:return: (start, end) in the Calendar API's shape, {'date': ...} for all-day events and {'dateTime': ...} otherwise."""
+        start, end = self.datetimes(time_zone)
+        if self.all_day:
+            return {"date": start.date().isoformat()}, {"date": end.date().isoformat()}
+        return {"dateTime": start.isoformat()}, {"dateTime": end.isoformat()}
+
+    def to_prompt(self, time_zone):
+        """The fields a model needs to talk about or pick the event, in the Calendar API's shape so edits come back in it too."""
+        start, end = self.to_google_times(time_zone)
+        compact = {"id": self.id, "summary": self.summary, "start": start, "end": end}
+        if self.location:
+            compact["location"] = self.location
+        if self.cancelled:
+            compact["status"] = "cancelled"
+        if self.recurring:
+            compact["recurring"] = True
+        return compact
+
+    # Events are distinct even when their times match
+    __eq__ = object.__eq__
+    __hash__ = object.__hash__
+
+    def __repr__(self):
+        return f"Event({self.summary!r}, {self.start}, {self.end})"
@@ -0,0 +1,187 @@
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+from googleapiclient.errors import HttpError
+from interval_index import IntervalIndex
+from event_model import Event, Interval, parse_datetime
+
+# Seconds a synced store is trusted before the next read triggers an incremental sync
+SYNC_INTERVAL = float(os.getenv("EVENT_STORE_SYNC_INTERVAL", 30))
+SYNC_PAGE_SIZE = 2500  # largest page the API allows, full syncs should take as few round-trips as possible
+
+# Query parameters of events().list that can be answered from the store, anything else goes to the network
+SUPPORTED_QUERY_PARAMS = {"calendarId", "timeMin", "timeMax", "maxResults", "q", "iCalUID", "orderBy", "singleEvents", "timeZone"}
+
+
+# Local copy of one calendar's events, kept fresh with incremental sync
+class EventStore:
+    def __init__(self, calendar_service, calendar_id='primary', sync_interval=SYNC_INTERVAL):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService.
+        :param calendar_id: The calendar mirrored by this store.
+        :param sync_interval: Seconds between incremental syncs triggered by reads.
+        """
+        self.service = calendar_service.service
+        self.calendar = calendar_service.aio
+        self.calendar_id = calendar_id
+        self.sync_interval = sync_interval
+        self.events = {}  # event id -> Google event dict, kept whole because updates send the full resource back
+        self.records = {}  # event id -> Event, the parsed form every read works on
+        self.time_zone = timezone.utc
+        self.sync_token = None
+        self.updated_min = None  # fallback cursor when the API doesn't hand out a sync token
+        self.last_sync = None
+        self._index = None  # IntervalIndex over busy events, rebuilt lazily after the store changes
+        self._lock = asyncio.Lock()
+
+    # SYNC
+    async def sync(self, force=False):
+        """
+        Bring the store up to date. Does nothing if the last sync is more recent than the sync interval, unless forced.
+        """
+        async with self._lock:
+            if not force and self.last_sync and time.monotonic() - self.last_sync < self.sync_interval:
+                return
+            started = datetime.now(timezone.utc)
+            try:
+                await self._sync_pages()
+            except HttpError as error:
+                if error.resp.status != 410:
+                    raise
+                # 410 Gone: the sync token expired, start over with a full sync
+                self.events.clear()
+                self.records.clear()
+                self.sync_token = self.updated_min = None
+                await self._sync_pages()
+            self.updated_min = started
+            self.last_sync = time.monotonic()
+
+    async def _sync_pages(self):
+        params = {"calendarId": self.calendar_id, "singleEvents": True}
+        if self.sync_token:
+            params["syncToken"] = self.sync_token
+        elif self.updated_min:
+            params.update(updatedMin=self.updated_min.isoformat(), showDeleted=True)
+
+        # Full events, agents update them from here and events().update replaces whatever is left out
+        async for result in self.calendar.list_pages(page_size=SYNC_PAGE_SIZE, **params):
+            if result.get("timeZone") and result["timeZone"] != getattr(self.time_zone, "key", None):
+                self.time_zone = ZoneInfo(result["timeZone"])
+                # All-day events were placed in the old timezone
+                self.records = {event_id: Event.from_google(event, self.time_zone) for event_id, event in self.events.items()}
+            for event in result.get("items", []):
+                self.upsert(event)
+            if not result.get("nextPageToken"):
+                self.sync_token = result.get("nextSyncToken")
+
+    # WRITES, called by agents after a successful insert/update/delete so reads see them without a sync
+    def upsert(self, event):
+        if event and event.get("id"):
+            if event.get("status") == "cancelled":
+                self.remove(event["id"])
+            else:
+                self.events[event["id"]] = event
+                self.records[event["id"]] = Event.from_google(event, self.time_zone)
+                self._index = None
+
+    def remove(self, event_id):
+        self.events.pop(event_id, None)
+        self.records.pop(event_id, None)
+        self._index = None
+
+    # READS
+    def record(self, event):
+        """:return: The Event for a Google event dict or body, parsed only if the store doesn't have it already."""
+        record = self.records.get(event.get("id"))
+        return record if record is not None else Event.from_google(event, self.time_zone)
+
+    def records_between(self, time_min=None, time_max=None):
+        """
+        Events overlapping [time_min, time_max), ordered by start time, like events().list with singleEvents and orderBy=startTime.
+
+        :param time_min: Aware datetime, or None for no lower bound.
+        :param time_max: Aware datetime, or None for no upper bound.
+        :return: List of Event.
+        """
+        low = time_min.timestamp() if time_min else float("-inf")
+        high = time_max.timestamp() if time_max else float("inf")
+        return sorted((record for record in self.records.values() if record.overlaps(low, high)), key=lambda record: record.start)
+
+    def events_between(self, time_min=None, time_max=None):
+        """Same as records_between, as Google event dicts."""
+        return [self.events[record.id] for record in self.records_between(time_min, time_max)]
+
+    def busy_between(self, time_min, time_max):
+        """
+        Merged busy periods clipped to [time_min, time_max), in the same shape freebusy().query returns.
+        """
+        periods = self.index().busy_periods(int(time_min.timestamp()), int(time_max.timestamp()))
+        return [Interval(start, end).to_iso(self.time_zone) for start, end in periods]
+
+    def index(self):
+        """
+        :return: An IntervalIndex over the busy events in the store, items are Event objects.
+        """
+        if self._index is None:
+            self._index = IntervalIndex((record.start, record.end, record) for record in self.records.values() if record.busy)
+        return self._index
+
+    def conflicts(self, event):
+        """
+        Busy events overlapping the given event body, answered locally without a network call.
+
+        :return: List of Event.
+        """
+        record = self.record(event)
+        return [other for other in self.index().overlapping(record.start, record.end) if other.id is None or other.id != record.id]
+
+    def can_answer(self, query):
+        return query.get("calendarId", "primary") == self.calendar_id and set(query) <= SUPPORTED_QUERY_PARAMS
+
+    def query(self, query):
+        """
+        Answer an events().list query from the store. Only valid when can_answer(query) is True.
+
+        :param query: Dict of events().list parameters.
+        :return: A list of events.
+        """
+        time_min = parse_datetime(query["timeMin"]) if query.get("timeMin") else None
+        time_max = parse_datetime(query["timeMax"]) if query.get("timeMax") else None
+        events = self.events_between(time_min, time_max)
+
+        if query.get("iCalUID"):
+            events = [event for event in events if event.get("iCalUID") == query["iCalUID"]]
+        if query.get("q"):
+            terms = query["q"].lower().split()
+            fields = ("summary", "description", "location")
+            events = [
+                event for event in events
+                if all(any(term in event.get(field, "").lower() for field in fields) for term in terms)
+            ]
+        if query.get("orderBy") == "updated":
+            events.sort(key=lambda event: event.get("updated", ""))
+        if query.get("maxResults"):
+            events = events[:int(query["maxResults"])]
+        return events
+
+
+# One store per user and calendar, shared by every agent so writes from one are visible to the others
+_stores = {}
+
+def get_event_store(calendar_service, calendar_id='primary'):
+    """
+    :param calendar_service: An authenticated instance of GoogleCalendarService, used if the store doesn't exist yet.
+    :param calendar_id: The calendar to mirror.
+    :return: The shared EventStore for the calendar of the service's user.
+    """
+    key = (calendar_service.user_id, calendar_id)
+    if key not in _stores:
+        _stores[key] = EventStore(calendar_service, calendar_id)
+    return _stores[key]
+
+def drop_event_stores(user_id):
+    """Forget every store of a user, e.g. when their service is evicted."""
+    for key in [key for key in _stores if key[0] == user_id]:
+        del _stores[key]
@@ -1,22 +1,34 @@
 import webbrowser
 import datetime
-from gcal_service import GoogleCalendarService  # Import the existing GoogleCalendarService class
+from gcal_service import get_calendar_service
 from model_initializer import ModelInitializer
+from calendar_batch import CalendarBatch
+from event_store import get_event_store
+from prompt_context import events_context
 import asyncio
 import json
 import textwrap
 import pytz
 
+# How far ahead to look for the event an instruction refers to
+EDIT_HORIZON_DAYS = 90
+
 class EventEditor:
-    def __init__(self):
-        # Use the GoogleCalendarService to handle authentication and service initialization
-        calendar_service = GoogleCalendarService()
+    def __init__(self, calendar_service=None):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService. Defaults to the process-wide one.
+        """
+        calendar_service = calendar_service or get_calendar_service()
+        self.calendar_service = calendar_service
         self.service = calendar_service.service
+        self.calendar = calendar_service.aio
+        self.store = get_event_store(calendar_service)
 
         self.model_init = ModelInitializer( # dedent used to get rid of indentation
             textwrap.dedent(f"""
                 You are a calendar assistant. You will recieve instructions as provided by the user, a list of the user's events, and current datetime info.
-                Pick the appropriate event, and output a new JSON object for that event with changes reflecting the instructions from the user.
+                Pick the appropriate event, and output a JSON object with that event's id and only the fields that change according to the instructions from the user.
+                To delete the event, output its id with "status": "cancelled".
                 (Summary is the name of the event)
                 IMPORTANT: IF THE USER INPUT IS AT ALL UNCLEAR, OR DOES NOT PERFECTLY MATCH UP TO AN EVENT FROM THE LIST, RETURN A JSON BRIEFLY DETAILING THE ERROR. This should be the DEFAULT behavior, i.e. most instruction possibilities should not match any event.
             """), # Currently configured for ONE output
@@ -31,57 +43,76 @@ class EventEditor:
         user_timezone = pytz.timezone(pytz.country_timezones('US')[0])
         # Passing current local time and user's timezone into the prompt so that model has proper awareness
 
-        prompt = textwrap.dedent(f"""
-            {action}
-            {events}
-            Right now it is {current_time} in {user_timezone}
-        """)
+        # Compact, ranked events instead of raw API dicts, so the prompt stays within the token budget
+        events_text, included = events_context(events, self.store.time_zone, query=action)
+        print(f"Sending {included} of {len(events)} events to the model")
+
+        prompt = f"{action}\n{events_text}\nRight now it is {current_time} in {user_timezone}"
         # Generate response
-        response = self.model_init.model.generate_content(prompt) # simple generate_content here because agent doesn't require ongoing thread communication
+        response = await self.model_init.generate(prompt) # simple non-blocking generate here because agent doesn't require ongoing thread communication
         return response
 
+    # The model only returns the fields it changes, lay them over the full stored event so nothing else is lost
+    def merge_stored(self, event_body):
+        stored = self.store.events.get(event_body.get('id'))
+        return {**stored, **event_body} if stored else event_body
+
     # Delete an event from Google Calendar by event ID
-    def delete_event(self, event_body):
+    async def delete_event(self, event_body):
         try:
-            event = self.service.events().delete(calendarId='primary', eventId=event_body['id']).execute()
+            event = await self.calendar.execute(self.service.events().delete(calendarId='primary', eventId=event_body['id']))
+            self.store.remove(event_body['id'])
             print('Event deleted:', event_body)
         except Exception as e:
             print(f"Error deleting event: {e}")
 
     # Update an event on Google Calendar by event ID
-    def update_event(self, event_body):
+    async def update_event(self, event_body):
         try:
-            event = self.service.events().update(calendarId='primary', eventId=event_body['id'], body=event_body).execute()
+            event = await self.calendar.execute(self.service.events().update(calendarId='primary', eventId=event_body['id'], body=event_body))
+            self.store.upsert(event)
             print('Event updated:', event_body)
             webbrowser.open(event.get('htmlLink'))  # Open event in Google Calendar UI
         except Exception as e:
             print(f"Error updating event: {e}")
 
+    # Apply several AI-generated event bodies in one batch request, cancelled events are deleted and the rest updated
+    async def apply_events(self, event_bodies):
+        batch = CalendarBatch(self.calendar_service)
+        for event_body in event_bodies:
+            if 'error' in event_body or 'id' not in event_body: # model couldn't match an event, nothing to apply
+                print(event_body)
+                continue
+            batch.delete(event_body) if event_body.get('status') == 'cancelled' else batch.update(self.merge_stored(event_body))
+
+        results = await batch.execute()
+        for result in results:
+            if result['error']:
+                print(f"Error applying {result['operation']} to event: {result['error']}")
+            else:
+                self.store.remove(result['event']['id']) if result['operation'] == 'delete' else self.store.upsert(result['response'])
+                print(f"Event {'deleted' if result['operation'] == 'delete' else 'updated'}:", result['event'])
+        return results
+
     # Get upcoming events from the user's Google Calendar, TEMPORARY METHOD, FUNCTIONALITY WILL BE OUTSOURCED TO SCRAPER AGENT
-    def get_events(self):
+    async def get_events(self):
         now = datetime.datetime.now(datetime.timezone.utc)
         try:
-            events_result = self.service.events().list(
-                calendarId="primary",
-                timeMin=(now + datetime.timedelta(days=0)).isoformat(), # change timedelta to test other timeframes
-                maxResults=10,
-                singleEvents=True,
-                orderBy="startTime"
-            ).execute()
-            events = events_result.get("items", [])
-            return events
+            await self.store.sync()
+            # Everything in the horizon is a candidate, event_edit_ai_server keeps the relevant ones within the prompt budget
+            return self.store.records_between(now, now + datetime.timedelta(days=EDIT_HORIZON_DAYS))
         except Exception as e:
             print(f"Error fetching events: {e}")
             return []
     
     # Given AI response, execute appropriate process
-    def process_response(self, response):
+    async def process_response(self, response):
         try:
             event_body = json.loads(response)
             if ('error' in event_body): # Currently, model is set up to return an error JSON if it can't find the right event, so this is handling that case
                 print(response)
             else:
-                self.delete_event(event_body) if event_body['status'] == 'cancelled' else self.update_event(event_body)
+                await (self.delete_event(event_body) if event_body.get('status') == 'cancelled' else self.update_event(self.merge_stored(event_body)))
         except Exception as e: # If any error occurs (usually improper model output resulting in json.loads not being able to parse), print the error and the output
             print(
                 textwrap.dedent(f"""
@@ -92,9 +123,9 @@ class EventEditor:
     
     # Given action, execute full flow (getting events, querying agent, processing response)
     async def invoke(self, action):
-        events = self.get_events()
+        events = await self.get_events()
         response = (await self.event_edit_ai_server(action, events)).text
-        self.process_response(response)
+        await self.process_response(response)
 
 # Testing
 async def main():
@@ -2,16 +2,23 @@ import webbrowser
 import datetime
 import asyncio
 import json
-from gcal_service import GoogleCalendarService  # Import the GoogleCalendarService class
+from gcal_service import get_calendar_service
 from model_initializer import ModelInitializer
+from calendar_batch import CalendarBatch
+from event_store import get_event_store
 import pytz
 import textwrap
 
 class EventInitializer:
-    def __init__(self):
-        # Initialize the Google Calendar Service
-        calendar_service = GoogleCalendarService()
+    def __init__(self, calendar_service=None):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService. Defaults to the process-wide one.
+        """
+        calendar_service = calendar_service or get_calendar_service()
+        self.calendar_service = calendar_service
         self.service = calendar_service.service
+        self.calendar = calendar_service.aio
+        self.store = get_event_store(calendar_service)
 
         self.model_init = ModelInitializer(
             textwrap.dedent(f"""
@@ -49,14 +56,16 @@ class EventInitializer:
             Right now it is {current_time} in {user_timezone}
         """)
         # Generate response
-        response = self.model_init.model.generate_content(prompt)
+        response = await self.model_init.generate(prompt)
         return response
 
     # Insert new event into Google Calendar
-    def add_event(self, event_body):
+    async def add_event(self, event_body):
         try:
             if self.validate_event_body(event_body):
-                event = self.service.events().insert(calendarId='primary', body=event_body).execute()  # Insert event
+                await self.warn_conflicts(event_body)
+                event = await self.calendar.execute(self.service.events().insert(calendarId='primary', body=event_body))  # Insert event
+                self.store.upsert(event)
                 print('Event created: ', event_body)
                 webbrowser.open(event.get('htmlLink'))  # Open event in Google Calendar UI
         except Exception as e:
@@ -67,15 +76,51 @@ class EventInitializer:
                 """)
             )
 
+    # Conflict check against the local index. The store only syncs when it's older than SYNC_INTERVAL, so this rarely costs a request
+    async def warn_conflicts(self, *event_bodies):
+        try:
+            await self.store.sync()
+        except Exception as e:  # the warning is best effort, don't fail the insert over it
+            print(f"Skipping conflict check, could not sync events: {e}")
+            return
+        for event_body in event_bodies:
+            try:
+                conflicts = self.store.conflicts(event_body)
+            except (KeyError, TypeError, ValueError):  # times the store can't read, the insert reports what's wrong with them
+                continue
+            for conflict in conflicts:
+                print(f"Warning: {event_body.get('summary', 'No Title')} overlaps with existing event {conflict.summary}")
+
+    # Insert several new events into Google Calendar with a single batch request
+    async def add_events(self, event_bodies):
+        batch = CalendarBatch(self.calendar_service)
+        valid = []
+        for event_body in event_bodies:
+            if self.validate_event_body(event_body):
+                valid.append(event_body)
+                batch.insert(event_body)
+            else:
+                print(f"Unexpected input format: {event_body}")
+
+        await self.warn_conflicts(*valid)
+        results = await batch.execute()
+        for result in results:
+            if result['error']:
+                print(f"Error creating event: {result['error']}")
+            else:
+                self.store.upsert(result['response'])
+                print('Event created: ', result['event'])
+        return results
+
     # Testing method to check scopes 
     def check_scopes(self):
         print(self.service.calendarList().get(calendarId='primary').execute())
     
     # Handle response from AI
-    def process_response(self, response):
+    async def process_response(self, response):
         try:
             event_body = json.loads(response)
-            self.add_event(event_body)
+            await self.add_event(event_body)
         except Exception as e:
             print(
                 textwrap.dedent(f"""
@@ -87,7 +132,7 @@ class EventInitializer:
     # Invoke agent, handles action to generate and process response
     async def invoke(self, action):
         response = (await self.event_init_ai_server(action)).text
-        self.process_response(response)
+        await self.process_response(response)
 
 
     # Helper method to validate event specifications
@@ -107,7 +152,7 @@ async def main():
     agent = EventInitializer()
 
     # Sample event for the next hour
-    agent.add_event(event_body={
+    await agent.add_event(event_body={
         'summary': 'Work on TimeSpace',
         'start': {
             'dateTime': datetime.datetime.now(datetime.timezone.utc).isoformat(),
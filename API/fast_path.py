@@ -0,0 +1,177 @@
+import re
+from datetime import date, timedelta
+
+# Requests longer than this are rarely simple lookups, leave them to the model
+MAX_FAST_PATH_LENGTH = 120
+# Shortest gap worth reporting as free time, in minutes
+MIN_FREE_MINUTES = 15
+
+EVENT_PATTERNS = [
+    re.compile(r"\bwhat(s| is| do i have| have i got)\b.*\b(calendar|schedule|agenda)\b"),
+    re.compile(r"\bwhat(s| is) (happening|going on|planned|scheduled|on)\b"),
+    re.compile(r"\bwhat do i have\b"),
+    re.compile(r"\b(show|list|tell me)\b.*\b(events|calendar|schedule|agenda|meetings)\b"),
+    re.compile(r"\b(what|any) (events|meetings)\b"),
+]
+FREE_PATTERNS = [
+    re.compile(r"\b(when )?am i (free|available)\b"),
+    re.compile(r"\bfree (time|times|slots)\b"),
+    re.compile(r"\b(my )?availability\b"),
+    re.compile(r"\bwhen do i have (time|a gap|an opening)\b"),
+]
+# Anything that changes the calendar, names a time of day or chains requests goes to the model
+NOT_CONFIDENT = re.compile(
+    r"\b(add|create|book|move|reschedule|delete|cancel|remove|change|edit|update|remind|invite)\b"
+    r"|\bschedule (a|an|my|the|me|it)\b"
+    r"|\b\d{1,2}(:\d\d)?\s*(am|pm)\b|\bnoon\b|\bmidnight\b"
+    r"|\band\b|\bthen\b|\balso\b"
+    r"|\b(week|weekend|month|through|until|between)\b"  # ranges aren't a single day
+    r"|\b(morning|afternoon|evening|tonight|night|before)\b|\bafter\b(?! tomorrow)"  # nor are parts of one, answers cover 7am-10pm
+)
+
+WEEKDAYS = {
+    "monday": 0, "mon": 0, "tuesday": 1, "tue": 1, "tues": 1, "wednesday": 2, "wed": 2,
+    "thursday": 3, "thu": 3, "thur": 3, "thurs": 3, "friday": 4, "fri": 4, "saturday": 5, "sat": 5, "sunday": 6, "sun": 6,
+}
+MONTHS = {
+    "january": 1, "jan": 1, "february": 2, "feb": 2, "march": 3, "mar": 3, "april": 4, "apr": 4, "may": 5,
+    "june": 6, "jun": 6, "july": 7, "jul": 7, "august": 8, "aug": 8, "september": 9, "sep": 9, "sept": 9,
+    "october": 10, "oct": 10, "november": 11, "nov": 11, "december": 12, "dec": 12,
+}
+_MONTH = "|".join(MONTHS)
+DATE_PATTERNS = [
+    ("relative", re.compile(r"\b(day after tomorrow|today|tonight|tomorrow|yesterday)\b")),
+    ("iso", re.compile(r"\b(\d{4})-(\d{2})-(\d{2})\b")),
+    ("numeric", re.compile(r"\b(\d{1,2})/(\d{1,2})(?:/(\d{2,4}))?\b")),
+    ("month_day", re.compile(rf"\b({_MONTH})\.? (\d{{1,2}})(?:st|nd|rd|th)?(?:,? (\d{{4}}))?\b")),
+    ("day_month", re.compile(rf"\b(\d{{1,2}})(?:st|nd|rd|th)? (?:of )?({_MONTH})\b(?:,? (\d{{4}}))?")),
+    ("weekday", re.compile(rf"\b(next |this |on )?({'|'.join(WEEKDAYS)})\b")),
+]
+RELATIVE_DAYS = {"today": 0, "tonight": 0, "tomorrow": 1, "day after tomorrow": 2, "yesterday": -1}
+
+
+def _normalize(text):
+    return re.sub(r"\s+", " ", text.lower().replace("’", "'").replace("'", "")).strip()
+
+
+def _upcoming(month, day, today):
+    """A date given without a year is the next one, "may 5" asked in October is next May."""
+    candidate = date(today.year, month, day)
+    return candidate if candidate >= today else date(today.year + 1, month, day)
+
+
+def _to_date(kind, groups, today):
+    if kind == "relative":
+        return today + timedelta(days=RELATIVE_DAYS[groups[0]])
+    if kind == "iso":
+        return date(int(groups[0]), int(groups[1]), int(groups[2]))
+    if kind == "numeric":  # US order, month first
+        if not groups[2]:
+            return _upcoming(int(groups[0]), int(groups[1]), today)
+        year = int(groups[2])
+        return date(year + 2000 if year < 100 else year, int(groups[0]), int(groups[1]))
+    if kind == "month_day":
+        return date(int(groups[2]), MONTHS[groups[0]], int(groups[1])) if groups[2] else _upcoming(MONTHS[groups[0]], int(groups[1]), today)
+    if kind == "day_month":
+        return date(int(groups[2]), MONTHS[groups[1]], int(groups[0])) if groups[2] else _upcoming(MONTHS[groups[1]], int(groups[0]), today)
+    # weekday: the next one, today included. "next friday" means different things to different people, so it's not handled.
+    if groups[0] == "next ":
+        return None
+    return today + timedelta(days=(WEEKDAYS[groups[1]] - today.weekday()) % 7)
+
+
+def parse_date(text, today):
+    """
+    Find the single date a request refers to.
+
+    :param text: Normalized request text.
+    :param today: The current date in the user's timezone.
+    :return: A date, or None if there is no date, more than one, or it is ambiguous.
+    """
+    found = []
+    remaining = text
+    for kind, pattern in DATE_PATTERNS:
+        for match in pattern.finditer(remaining):
+            try:
+                found.append(_to_date(kind, match.groups(), today))
+            except ValueError:  # e.g. 2/30
+                return None
+        remaining = pattern.sub(" ", remaining)  # "day after tomorrow" must not match "tomorrow" again
+    if len(found) != 1:
+        return None
+    return found[0]
+
+
+def match_intent(text, today):
+    """
+    Recognize simple lookups that can be answered without the model.
+
+    :param text: The user's request.
+    :param today: The current date in the user's timezone.
+    :return: (task type, 'YYYY-MM-DD') with the task type being "retrieve events" or "retrieve free times",
+             or None when the request isn't clearly one of them.
+    """
+    if len(text) > MAX_FAST_PATH_LENGTH:
+        return None
+    text = _normalize(text)
+    if NOT_CONFIDENT.search(text):
+        return None
+    wants_events = any(pattern.search(text) for pattern in EVENT_PATTERNS)
+    wants_free = any(pattern.search(text) for pattern in FREE_PATTERNS)
+    if wants_events == wants_free:  # neither, or both
+        return None
+    day = parse_date(text, today)
+    if day is None:
+        return None
+    return ("retrieve events" if wants_events else "retrieve free times"), day.isoformat()
+
+
+def _clock(moment):
+    text = moment.strftime("%I:%M %p").lstrip("0")
+    return text.replace(":00", "")
+
+
+def _day(day):
+    day = date.fromisoformat(day)
+    return f"{day.strftime('%A, %B')} {day.day}"
+
+
+def render_events(day, events, time_zone):
+    """
+    :param day: 'YYYY-MM-DD'.
+    :param events: List of Event on that day, ordered by start time.
+    :param time_zone: The calendar's timezone.
+    :return: A sentence listing the events.
+    """
+    if not events:
+        return f"You have no events scheduled for {_day(day)}."
+    descriptions = []
+    for event in events:
+        if event.all_day:
+            descriptions.append(f"{event.summary} (all day)")
+            continue
+        start, end = event.datetimes(time_zone)
+        descriptions.append(f"{event.summary} from {_clock(start)} to {_clock(end)}")
+    if len(descriptions) == 1:
+        return f"On {_day(day)}, you have {descriptions[0]}."
+    return f"On {_day(day)}, you have {', '.join(descriptions[:-1])} and {descriptions[-1]}."
+
+
+def render_free_times(day, slots, time_zone, work_start, work_end):
+    """
+    :param day: 'YYYY-MM-DD'.
+    :param slots: Free slots as returned by GcalScraper.free_intervals, a list of Interval.
+    :param time_zone: The calendar's timezone.
+    :param work_start: Hour the searched day starts (float, 7.5 is 7:30).
+    :param work_end: Hour it ends.
+    :return: A sentence listing the free times.
+    """
+    if not slots:
+        return f"You have no free time on {_day(day)}."
+    if len(slots) == 1 and slots[0].duration >= (work_end - work_start) * 3600:
+        return f"You are free all day on {_day(day)}."
+    times = [slot.datetimes(time_zone) for slot in slots]
+    ranges = [f"from {_clock(start)} to {_clock(end)}" for start, end in times]
+    if len(ranges) == 1:
+        return f"On {_day(day)}, you are free {ranges[0]}."
+    return f"On {_day(day)}, you are free {', '.join(ranges[:-1])} and {ranges[-1]}."
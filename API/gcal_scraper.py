@@ -1,12 +1,30 @@
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 from googleapiclient.errors import HttpError
-from gcal_service import GoogleCalendarService
+from gcal_service import get_calendar_service
 from model_initializer import ModelInitializer
+from event_store import get_event_store
+from event_model import Interval
+from slot_finder import busy_periods_to_array
+from offload import run_cpu
 import textwrap
 import pytz
 import json
 import asyncio
+import numpy as np
+
+# Freebusy limits: calendars per request, and the longest window we ask for in one request
+MAX_FREEBUSY_CALENDARS = 50
+MAX_FREEBUSY_DAYS = 60
+
+# Some calendars' busy times couldn't be read (not found, not shared with the user...). They must not be taken as free.
+class FreeBusyUnavailable(Exception):
+    def __init__(self, errors):
+        """:param errors: Dict of calendar ID -> list of freebusy error dicts, e.g. [{'domain': 'global', 'reason': 'notFound'}]."""
+        reasons = "; ".join(f"{calendar_id}: {', '.join(error.get('reason', '?') for error in errors[calendar_id])}" for calendar_id in errors)
+        super().__init__(f"Busy times unavailable for {reasons}")
+        self.errors = errors
+
 
 # Class to scrape Google Calendar (Gcal)
 class GcalScraper:
@@ -16,7 +34,9 @@ class GcalScraper:
         :param calendar_service: An instance of GoogleCalendarService.
         """
         self.service = calendar_service.service
-        self.calendar_time_zone = self._fetch_primary_timezone() # Be careful, this gets the calendar
+        self.calendar = calendar_service.aio
+        self.store = get_event_store(calendar_service)  # local copy of the primary calendar, reads are answered from here
+        self._time_zone = None  # primary calendar's timezone, fetched on first use instead of blocking the constructor
         self.model_init = ModelInitializer(
             textwrap.dedent(f"""
                 You are an agent for a Google Calendar AI assistant. Your job is to craft query parameters that will list out the 'relevant' events based on the prompt, to supply context for the actions other agents. You will be given local time and the timezone of the user.
@@ -79,18 +99,19 @@ class GcalScraper:
             Right now it is {current_time} in {user_timezone}
         """)
         # Generate response
-        response = self.model_init.model.generate_content(prompt)
+        response = await self.model_init.generate(prompt, cache=True)
         return response
     
-    def process_response(self, response):
+    async def process_response(self, response):
         try:
             query = json.loads(response)
             print("Query:", query)
-            events_result = self.service.events().list(
-                **query
-            ).execute()
-            events = events_result.get("items", [])
-            return events
+            if self.store.can_answer(query):
+                await self.store.sync()
+                return self.store.query(query)
+            # maxResults is how many events the model wants in total, not a page size
+            limit = query.pop("maxResults", None)
+            return [event async for event in self.calendar.list_events(limit=int(limit) if limit else None, **query)]
         except Exception as e:
             print(textwrap.dedent(f"""
                 {e}
@@ -100,9 +121,16 @@ class GcalScraper:
 
     async def invoke(self, action):
         response = (await self.event_list_ai_server(action)).text
-        return self.process_response(response)
+        return await self.process_response(response)
 
     # DETERMINISTIC WORKFLOW
+    @property
+    def calendar_time_zone(self):
+        """The primary calendar's timezone. Coroutines should await load_time_zone() first so this never blocks."""
+        if self._time_zone is None:
+            self._time_zone = self._fetch_primary_timezone()
+        return self._time_zone
+
     def _fetch_primary_timezone(self):
         """Fetch the primary calendar's timezone."""
         try:
@@ -112,52 +140,140 @@ class GcalScraper:
             print(f"Error fetching primary calendar timezone: {error}")
             raise
 
-    def get_events_on_date(self, event_date):
+    async def load_time_zone(self):
+        """Fetch the primary calendar's timezone without blocking the event loop, once."""
+        if self._time_zone is None:
+            calendar = await self.calendar.execute(self.service.calendars().get(calendarId='primary'))
+            self._time_zone = ZoneInfo(calendar['timeZone'])
+        return self._time_zone
+
+    async def get_events_on_date(self, event_date):
         """
         Get all events on a specific date from the primary calendar.
 
         :param event_date: A string date in 'YYYY-MM-DD' format.
-        :return: A list of events on the given date.
+        :return: A list of Event (see event_model.py) on the given date, ordered by start time.
         """
+        await self.load_time_zone()
         event_date_dt = self._convert_to_datetime(event_date)
         event_end_dt = event_date_dt + timedelta(days=1) - timedelta(seconds=1)
 
         try:
-            events = self.service.events().list(
-                calendarId='primary',
-                timeMin=event_date_dt.isoformat(),
-                timeMax=event_end_dt.isoformat(),
-                timeZone=self.calendar_time_zone.key
-            ).execute()
-
-            return events.get('items', [])
-        except HttpError as error:
+            await self.store.sync()
+            return self.store.records_between(event_date_dt, event_end_dt)
+        except (HttpError, asyncio.TimeoutError) as error:
             print(f"Error fetching events: {error}")
             return []
 
-    def get_busy_times(self, event_date):
+    async def get_busy_times(self, event_date):
         """
         Get the busy times (i.e., time ranges where events exist) on a specific date for the primary calendar.
 
         :param event_date: A string date in 'YYYY-MM-DD' format.
         :return: A dictionary containing busy times for the specified date.
         """
+        await self.load_time_zone()
         event_date_dt = self._convert_to_datetime(event_date)
         event_end_dt = event_date_dt + timedelta(days=1) - timedelta(seconds=1)
 
+        try:
+            await self.store.sync()
+            return self.store.busy_between(event_date_dt, event_end_dt)
+        except (HttpError, asyncio.TimeoutError) as error:
+            print(f"Error fetching busy times: {error}")
+            return {}
+
+    async def get_busy_intervals(self, calendar_ids, time_min, time_max):
+        """
+        Get the busy periods of several calendars (or attendees) over any window with as few freebusy requests as possible.
+        The window and calendar list are split only where the API's limits require it, and the pieces are fetched concurrently.
+
+        :param calendar_ids: List of calendar IDs or attendee email addresses.
+        :param time_min: Timezone-aware datetime where the window starts.
+        :param time_max: Timezone-aware datetime where the window ends.
+        :return: Dictionary of calendar ID -> int64 NumPy array of shape (n, 2) with sorted, merged (start, end) epoch seconds.
+        :raises FreeBusyUnavailable: If any calendar's busy times couldn't be read, with the failing calendars in .errors.
+        :raises HttpError: If a freebusy request failed as a whole.
+        """
+        await self.load_time_zone()
+        windows = []
+        window_start = time_min
+        while window_start < time_max:
+            window_end = min(window_start + timedelta(days=MAX_FREEBUSY_DAYS), time_max)
+            windows.append((window_start, window_end))
+            window_start = window_end
+        groups = [calendar_ids[i:i + MAX_FREEBUSY_CALENDARS] for i in range(0, len(calendar_ids), MAX_FREEBUSY_CALENDARS)]
+
+        results = await asyncio.gather(*(
+            self._query_freebusy(group, window_start, window_end)
+            for group in groups for window_start, window_end in windows
+        ))
+
+        periods = {calendar_id: [] for calendar_id in calendar_ids}
+        errors = {}
+        for busy_by_calendar, errors_by_calendar in results:
+            for calendar_id, busy in busy_by_calendar.items():
+                periods.setdefault(calendar_id, []).append(busy)
+            for calendar_id, calendar_errors in errors_by_calendar.items():
+                errors.setdefault(calendar_id, []).extend(calendar_errors)
+        if errors:
+            raise FreeBusyUnavailable(errors)
+        return {calendar_id: self._merge_busy(busy) for calendar_id, busy in periods.items()}
+
+    async def _query_freebusy(self, calendar_ids, time_min, time_max):
+        """
+        One freebusy request.
+
+        :return: (busy, errors): calendar ID -> int64 array of (start, end) epoch seconds for the calendars that could be read,
+                 and calendar ID -> list of error dicts for the ones that couldn't.
+        """
         body = {
-            "timeMin": event_date_dt.isoformat(),
-            "timeMax": event_end_dt.isoformat(),
+            "timeMin": time_min.isoformat(),
+            "timeMax": time_max.isoformat(),
             "timeZone": self.calendar_time_zone.key,
-            "items": [{"id": 'primary'}]
+            "calendarExpansionMax": MAX_FREEBUSY_CALENDARS,
+            "items": [{"id": calendar_id} for calendar_id in calendar_ids]
         }
 
-        try:
-            events_result = self.service.freebusy().query(body=body).execute()
-            return events_result.get('calendars', {})['primary']['busy']
-        except HttpError as error:
-            print(f"Error fetching busy times: {error}")
-            return {}
+        result = await self.calendar.execute(self.service.freebusy().query(body=body))
+
+        busy = {}
+        errors = {}
+        for calendar_id, calendar in result.get('calendars', {}).items():
+            if calendar.get('errors'):
+                errors[calendar_id] = calendar['errors']
+                continue
+            periods = [(period['start'], period['end']) for period in calendar.get('busy', [])]
+            busy[calendar_id] = await run_cpu(busy_periods_to_array, periods, size=len(periods) * 64)
+        return busy, errors
+
+    @staticmethod
+    def _merge_busy(busy):
+        """Sort and merge busy periods, joining the ones that were cut at a window boundary."""
+        intervals = np.concatenate(busy) if busy else np.empty((0, 2), dtype=np.int64)
+        intervals = intervals[np.lexsort((intervals[:, 1], intervals[:, 0]))]
+        if len(intervals) < 2:
+            return intervals
+        # A new run starts wherever an interval begins after everything before it has ended
+        running_end = np.maximum.accumulate(intervals[:, 1])
+        run_starts = np.flatnonzero(np.concatenate(([True], intervals[1:, 0] > running_end[:-1])))
+        run_ends = np.concatenate((run_starts[1:], [len(intervals)])) - 1
+        return np.column_stack((intervals[run_starts, 0], running_end[run_ends]))
+
+    async def get_busy_times_range(self, start_date, end_date, calendar_ids=("primary",)):
+        """
+        Get the busy times of several calendars for a range of dates in one go.
+
+        :param start_date: A string date in 'YYYY-MM-DD' format, first day of the range.
+        :param end_date: A string date in 'YYYY-MM-DD' format, last day of the range (inclusive).
+        :param calendar_ids: Calendar IDs or attendee email addresses.
+        :return: Dictionary of calendar ID -> int64 NumPy array of (start, end) epoch seconds.
+        :raises FreeBusyUnavailable: If any calendar's busy times couldn't be read.
+        """
+        await self.load_time_zone()
+        time_min = self._convert_to_datetime(start_date)
+        time_max = self._convert_to_datetime(end_date) + timedelta(days=1)
+        return await self.get_busy_intervals(list(calendar_ids), time_min, time_max)
 
     def _convert_to_datetime(self, date_string):
         """
@@ -173,41 +289,26 @@ class GcalScraper:
     
     def parse_times(self, times):
         """
-        Helper function to parse time blocks and return a list of start and end times in datetime format.
+        Helper function to parse time blocks into Intervals.
 
         :param times (dict): Dictionary containing time periods with 'start' and 'end' times in ISO 8601 format.
                                   Example structure: [{'start': 'ISO format', 'end': 'ISO format'}, ...]
 
-        :return times_converted (list): List of tuples where each tuple contains the start and end times as datetime objects.
+        :return times_converted (list): List of Interval (epoch seconds).
         """
-
-        times_converted = []
-        for time_block in times:
-            start_time = datetime.fromisoformat(time_block['start'])
-            end_time = datetime.fromisoformat(time_block['end'])
-            times_converted.append((start_time, end_time))
-        
-        return times_converted
+        return [Interval.from_iso(time_block) for time_block in times]
     
     def format_times(self, times):
         """
-        Helper function to format time slots into a list of dictionaries with ISO format strings.
+        Helper function to format time slots into a list of dictionaries with ISO format strings, in the calendar's timezone.
 
-        :param times (list): List of tuples with start and end times for all different time slots.
+        :param times (list): List of Interval for all different time slots.
 
         :return formatted_times (list): List of dictionaries representing time slots with 'start' and 'end' keys.
         """
-
-        formatted_times = []
-        for start, end in times:
-            formatted_times.append({
-                'start': start.isoformat(),
-                'end': end.isoformat()
-            })
-
-        return formatted_times
+        return [interval.to_iso(self.calendar_time_zone) for interval in times]
         
-    def find_times(self, date, duration, start_time = 7.0, end_time = 22.0):
+    async def find_times(self, date, duration, start_time = 7.0, end_time = 22.0):
         """
         Finds and returns all available time slots on a specific date for the given duration, excluding busy periods, for the primary calendar.
 
@@ -216,17 +317,19 @@ class GcalScraper:
         :param start_time: A float that represents the time at which your working day starts (time when you wake up) in millitary time. 7:30 would be represented as 7.5. Default: 7am.
         :param end_time: A float that represents the time at which your working day ends (time when you sleep) in millitary time. Default: 10pm.
 
-        :return formatted_free_times (list): A list of available time slots, formatted and sorted, each represented 
-                                            as a tuple containing start and end times in datetime format.
+        :return formatted_free_times (list): A list of available time slots, sorted, each represented
+                                            as a dictionary with 'start' and 'end' ISO strings.
+        """
+        # Format the free times to be helpful later
+        return self.format_times(await self.free_intervals(date, duration, start_time, end_time))
+
+    async def free_intervals(self, date, duration, start_time = 7.0, end_time = 22.0):
+        """
+        Same as find_times, returning the slots as Intervals.
         """
+        await self.load_time_zone()
 
-        #Get all the busy times on a given date
-        busy_times_raw = self.get_busy_times(date)
-        busy_times = self.parse_times(busy_times_raw)
         date = self._convert_to_datetime(date)
-        
-        # Sort busy times by start time
-        busy_times.sort(key=lambda x: x[0])
 
         #Get the exact hour and minutes from start and end times
         start_hour = int(start_time)
@@ -238,41 +341,29 @@ class GcalScraper:
         # Define the working day time range (Default 7am - 10pm)
         work_start_time = date.replace(hour= start_hour, minute=start_minute, second=0, microsecond=0)
         work_end_time = date.replace(hour= end_hour, minute=end_minute, second=0, microsecond=0)
-        
-        # Convert the duration to a timedelta object
-        duration_delta = timedelta(minutes=duration)
-        
-        available_times = []
-        current_time = work_start_time
-
-        # Loop through busy times and find available gaps
-        for busy_start, busy_end in busy_times:
-            # Check if there is a gap between the current time and the next busy period
-            if busy_start > current_time:
-                gap = busy_start - current_time
-                # If the gap is larger than or equal to the duration, it's an available slot
-                if gap >= duration_delta:
-                    available_times.append((current_time, busy_start))
-
-            # Move the current time to the end of the busy period
-            current_time = max(current_time, busy_end)
-
-        # Check for availability between the end of the last busy period and the end of the workday
-        if work_end_time > current_time:
-            gap = work_end_time - current_time
-            if gap >= duration_delta:
-                available_times.append((current_time, work_end_time))
 
-        # Format the free times to be helpful later
-        formatted_free_times = self.format_times(available_times)
-        
-        # Return the formatted free times
-        return formatted_free_times
+        # Look up the gaps between busy periods in the local index, no freebusy request needed
+        return await self.find_free_slots(work_start_time, work_end_time, duration)
+
+    async def find_free_slots(self, time_min, time_max, duration):
+        """
+        Finds free slots of at least the given duration between two datetimes, which may span several days.
+
+        :param time_min: Timezone-aware datetime where the search window starts.
+        :param time_max: Timezone-aware datetime where the search window ends.
+        :param duration: An integer representing the desired duration in minutes.
+
+        :return available_times (list): List of Interval, sorted by start time.
+        """
+        await self.load_time_zone()
+        await self.store.sync()
+        slots = self.store.index().free_slots(int(time_min.timestamp()), int(time_max.timestamp()), duration * 60)
+        return [Interval(start, end) for start, end in slots]
 
 
 async def main():
     # Instantiate the GoogleCalendarService
-    calendar_service = GoogleCalendarService()
+    calendar_service = get_calendar_service()
 
     # Instantiate the GcalScraper using the authenticated calendar service
     cal_scraper = GcalScraper(calendar_service)
@@ -287,17 +378,18 @@ async def main():
     
     # COMMENTED OUT FOR TESTING, BUT TOO MUCH PROCESSING FOR MAIN FUNCTION
     """ # Get events on a specific date
-    events = cal_scraper.get_events_on_date('2024-10-23')
+    events = await cal_scraper.get_events_on_date('2024-10-23')
     if events:
         for event in events:
-            print("Event:", event.get('summary', 'No Title'))
-            print("Start:", event['start'].get('dateTime', 'All-day event'))
-            print("End:", event['end'].get('dateTime', 'All-day event'))
+            start, end = event.datetimes(cal_scraper.calendar_time_zone)
+            print("Event:", event.summary)
+            print("Start:", 'All-day event' if event.all_day else start.isoformat())
+            print("End:", 'All-day event' if event.all_day else end.isoformat())
     else:
         print("No events found.")
 
     # Get busy times on a specific date
-    busy_times = cal_scraper.get_busy_times('2024-10-24')
+    busy_times = await cal_scraper.get_busy_times('2024-10-24')
     print(busy_times)
 
     print("Busy times: ")
@@ -309,7 +401,7 @@ async def main():
         print() 
 
     #Find time slots available for atleast an hour on a specifc date for between specific times
-    free_times = cal_scraper.find_times('2024-10-24', 60, 7.5, 23)
+    free_times = await cal_scraper.find_times('2024-10-24', 60, 7.5, 23)
     print(free_times)
 
     print("Free times: ")
@@ -1,48 +1,348 @@
+import asyncio
 import datetime
+import os
 import os.path
+import threading
+import time
+import json
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import httplib2
+import google_auth_httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
+from governor import calendar_governor, AmbiguousTimeout
+from credential_store import create_credential_store, DEFAULT_USER
+from event_store import drop_event_stores
 
 # Define the scope for Google Calendar API
 SCOPES = ["https://www.googleapis.com/auth/calendar"]
 
+# Sizing for the worker pool that runs blocking .execute() calls
+CALENDAR_WORKERS = int(os.getenv("CALENDAR_WORKERS", 8))
+CALENDAR_MAX_IN_FLIGHT = int(os.getenv("CALENDAR_MAX_IN_FLIGHT", CALENDAR_WORKERS))
+CALENDAR_TIMEOUT = float(os.getenv("CALENDAR_TIMEOUT", 30))
+# Most events events().list hands out per page
+LIST_MAX_PAGE_SIZE = 2500
+# Event fields read when answering queries, everything else (etags, links, creator, attendee lists...) is left out
+EVENT_QUERY_FIELDS = "id,iCalUID,status,summary,description,location,start,end,recurringEventId,transparency,htmlLink"
+
+# Seconds before the access token expires that the background refresh kicks in
+CREDENTIAL_REFRESH_MARGIN = 300
+# Authorized clients kept warm, and how long an unused one is kept
+CALENDAR_MAX_CLIENTS = int(os.getenv("CALENDAR_MAX_CLIENTS", 100))
+CALENDAR_CLIENT_IDLE = float(os.getenv("CALENDAR_CLIENT_IDLE", 1800))
+
+
+class NotAuthenticated(Exception):
+    pass
+
+
 # Class to manage Google Calendar service and events
 class GoogleCalendarService:
-    def __init__(self):
+    def __init__(self, user_id=DEFAULT_USER, credential_store=None):
+        """
+        :param user_id: Whose calendar this service acts on.
+        :param credential_store: Where the user's tokens are kept, see credential_store.py. Defaults to the configured store.
+        """
+        self.user_id = user_id
+        self.credential_store = credential_store or create_credential_store()
         self.creds = None
         self.service = None
+        self._refresh_task = None
+        self._loop = None
+        self.closed = False  # evicted from the pool, callers still holding it keep working but nothing refreshes in the background
         self.authenticate()
+        self.aio = AsyncCalendarClient(self)  # Use this from coroutines instead of calling .execute() directly
 
     # Authenticate and get the Google Calendar service
     def authenticate(self):
-        """Authenticates the user and initializes the Google Calendar API service."""
-        # The file token.json stores the user's access and refresh tokens.
-        if os.path.exists("token.json"):
-            self.creds = Credentials.from_authorized_user_file("token.json", SCOPES)
+        """
+        Authenticates the user and initializes the Google Calendar API service.
+
+        :raises NotAuthenticated: If a user other than the default one has no usable token. Only the default
+                                  (local) user is sent through the interactive login flow.
+        """
+        # The credential store holds the user's access and refresh tokens.
+        token_json = self.credential_store.load(self.user_id)
+        if token_json:
+            self.creds = Credentials.from_authorized_user_info(json.loads(token_json), SCOPES)
 
         # If credentials are invalid or not present, prompt user for login
         if not self.creds or not self.creds.valid:
             if self.creds and self.creds.expired and self.creds.refresh_token:
                 self.creds.refresh(Request())
+            elif self.user_id != DEFAULT_USER:
+                raise NotAuthenticated(f"No Google Calendar authorization for user {self.user_id}")
             else:
                 flow = InstalledAppFlow.from_client_secrets_file("credentials.json", SCOPES)
                 self.creds = flow.run_local_server(port=0)
             
             # Save credentials for future use
-            with open("token.json", "w") as token:
-                token.write(self.creds.to_json())
+            self._save_credentials()
 
         try:
-            self.service = build("calendar", "v3", credentials=self.creds)
+            # The discovery document bundled with the client library, so building the service makes no request
+            self.service = build(
+                "calendar", "v3",
+                http=google_auth_httplib2.AuthorizedHttp(self.creds, http=httplib2.Http(timeout=CALENDAR_TIMEOUT)),
+                static_discovery=True, cache_discovery=False
+            )
         except HttpError as error:
             print(f"An error occurred: {error}")
 
+    def _save_credentials(self):
+        self.credential_store.save(self.user_id, self.creds.to_json())
+
+    def refresh_credentials(self):
+        """Refresh the access token in place. Every transport shares self.creds, so they all pick up the new token."""
+        self.creds.refresh(Request())
+        self._save_credentials()
+
+    def start_background_refresh(self):
+        """Keep the access token fresh from the running event loop, so no request has to wait on a refresh. Safe to call repeatedly."""
+        if self._refresh_task is None and not self.closed and self.creds and self.creds.refresh_token:
+            self._loop = asyncio.get_running_loop()
+            self._refresh_task = self._loop.create_task(self._refresh_loop())
+
+    def close(self):
+        """Stop the background refresh for good, later requests refresh the token on demand instead. Safe to call from any thread."""
+        self.closed = True
+        if self._refresh_task is not None:
+            self._loop.call_soon_threadsafe(self._refresh_task.cancel)
+            self._refresh_task = None
+
+    async def _refresh_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            if self.creds.expiry is None:
+                wait = CREDENTIAL_REFRESH_MARGIN
+            else:  # google-auth keeps expiry as naive UTC
+                now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+                wait = max(0, (self.creds.expiry - now).total_seconds() - CREDENTIAL_REFRESH_MARGIN)
+            await asyncio.sleep(wait)
+            try:
+                await loop.run_in_executor(AsyncCalendarClient._executor, self.refresh_credentials)
+            except Exception as error:
+                print(f"Background credential refresh failed: {error}")
+                await asyncio.sleep(60)
+
+
+# Warm, authorized services by user, so requests reuse a client instead of re-authenticating
+class CalendarServicePool:
+    def __init__(self, credential_store=None, max_clients=CALENDAR_MAX_CLIENTS, idle_timeout=CALENDAR_CLIENT_IDLE):
+        """
+        :param credential_store: Where users' tokens are kept. Defaults to the configured store.
+        :param max_clients: Services kept at once, the least recently used one is closed beyond that.
+        :param idle_timeout: Seconds an unused service is kept.
+        """
+        self.credential_store = credential_store or create_credential_store()
+        self.max_clients = max_clients
+        self.idle_timeout = idle_timeout
+        self.clients = OrderedDict()  # user id -> (last used, service), least recently used first
+        self._lock = threading.Lock()
+        self._user_locks = {}  # user id -> lock held while that user's service is built
+
+    def get(self, user_id=DEFAULT_USER):
+        """
+        Get the user's service, authenticating on first use. Blocking, call from a worker thread
+        (await asyncio.to_thread(pool.get, user_id)) when the service may not exist yet.
+
+        :raises NotAuthenticated: If the user has no usable token.
+        """
+        with self._lock:
+            service = self._touch(user_id)
+            # Sweep on every call, not only when a user is added, so idle services (and their refresh loops) don't outlive the timeout
+            evicted = self._evict()
+            if service is None:
+                user_lock = self._user_locks.setdefault(user_id, threading.Lock())
+        self._close(evicted)
+        if service is not None:
+            return service
+
+        # Users authenticate in parallel, only requests for the same user wait on each other
+        with user_lock:
+            with self._lock:
+                service = self._touch(user_id)
+            if service is None:
+                started = time.perf_counter()
+                service = GoogleCalendarService(user_id, self.credential_store)
+                print(f"Calendar service for {user_id} ready in {(time.perf_counter() - started) * 1000:.0f} ms")
+                with self._lock:
+                    self.clients[user_id] = (time.monotonic(), service)
+                    evicted = self._evict()
+                self._close(evicted)
+        return service
+
+    @staticmethod
+    def _close(services):
+        for stale in services:
+            stale.close()
+            drop_event_stores(stale.user_id)
+
+    def _touch(self, user_id):
+        entry = self.clients.get(user_id)
+        if entry is None:
+            return None
+        self.clients[user_id] = (time.monotonic(), entry[1])
+        self.clients.move_to_end(user_id)
+        return entry[1]
+
+    def _evict(self):
+        """:return: The services removed, to be closed outside the lock."""
+        evicted = []
+        cutoff = time.monotonic() - self.idle_timeout
+        # Always keep the newest service
+        while len(self.clients) > 1:
+            user_id, (last_used, service) = next(iter(self.clients.items()))
+            if len(self.clients) <= self.max_clients and last_used >= cutoff:
+                break
+            del self.clients[user_id]
+            self._user_locks.pop(user_id, None)
+            evicted.append(service)
+        return evicted
+
+
+# The process-wide pool
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_calendar_service(user_id=DEFAULT_USER):
+    """
+    Get the shared GoogleCalendarService for a user, authenticating on first use.
+    Safe to call from worker threads, e.g. await asyncio.to_thread(get_calendar_service, user_id).
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = CalendarServicePool()
+    return _pool.get(user_id)
+
+
+# Async facade that runs Calendar requests on a bounded, process-wide thread pool
+class AsyncCalendarClient:
+    # Shared by every client so the cap applies to the whole process, not per agent
+    _executor = ThreadPoolExecutor(max_workers=CALENDAR_WORKERS, thread_name_prefix="gcal")
+    _semaphore = asyncio.Semaphore(CALENDAR_MAX_IN_FLIGHT)
+
+    def __init__(self, calendar_service, timeout=CALENDAR_TIMEOUT):
+        """
+        :param calendar_service: An authenticated instance of GoogleCalendarService.
+        :param timeout: Default seconds to wait for a single request.
+        """
+        self.calendar_service = calendar_service
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _http(self):
+        """httplib2 is not thread safe, so every worker thread gets its own authorized transport."""
+        http = getattr(self._local, "http", None)
+        if http is None:
+            http = google_auth_httplib2.AuthorizedHttp(
+                self.calendar_service.creds,
+                http=httplib2.Http(timeout=self.timeout)
+            )
+            self._local.http = http
+        return http
+
+    def _execute(self, request):
+        return request.execute(http=self._http())
+
+    @staticmethod
+    def _idempotent(request):
+        """Whether sending the request again is harmless. Batches can hold anything and a POST (insert, import) could land twice."""
+        if getattr(request, "method", None) in ("GET", "PUT", "PATCH", "DELETE"):
+            return True
+        return getattr(request, "method", None) == "POST" and request.uri.split("?")[0].endswith("/freeBusy")  # read-only
+
+    async def execute(self, request, timeout=None, cost=1):
+        """
+        Execute a prepared request (e.g. service.events().list(...)) without blocking the event loop.
+        Rate limited per user and retried on quota and server errors, see governor.calendar_governor.
+
+        :param request: An HttpRequest or BatchHttpRequest built from the Calendar service.
+        :param timeout: Seconds to wait before giving up. Defaults to the client timeout.
+        :param cost: Requests this counts as against the quota, e.g. the number of items in a batch.
+        :return: The parsed response, same as request.execute().
+        :raises asyncio.TimeoutError: If the request still does not complete within the timeout after retrying.
+        :raises governor.AmbiguousTimeout: If a request that isn't safe to repeat (insert, import, batch) timed out. It is
+                                          not retried, wait_for stops waiting but the worker thread may still send it.
+        :raises governor.CircuitOpen: If Calendar has been failing and calls are paused.
+        """
+        timeout = self.timeout if timeout is None else timeout
+        self.calendar_service.start_background_refresh()
+
+        idempotent = self._idempotent(request)
+
+        async def attempt():
+            async with self._semaphore:
+                loop = asyncio.get_running_loop()
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(self._executor, self._execute, request),
+                        timeout=timeout
+                    )
+                except (asyncio.TimeoutError, TimeoutError) as error:  # wait_for, or the socket timeout inside the thread
+                    if idempotent:
+                        raise
+                    raise AmbiguousTimeout(f"Calendar request timed out and may still be applied: {error}") from error
+
+        return await calendar_governor.call(attempt, key=self.user_key, costs={"requests": cost})
+
+    @property
+    def user_key(self):
+        """Identifies whose quota a request counts against."""
+        return self.calendar_service.user_id
+
+    async def list_pages(self, fields=None, page_size=None, **params):
+        """
+        Iterate over events().list result pages, requesting each one only when the consumer asks for it.
+
+        :param fields: Partial-response mask for each event, e.g. EVENT_QUERY_FIELDS. None returns full events.
+        :param page_size: Events per page, at most LIST_MAX_PAGE_SIZE. Defaults to params['maxResults'] or the API default.
+        :param params: events().list parameters (calendarId, timeMin, singleEvents, syncToken...), pageToken excluded.
+        :return: Async iterator of result dicts with 'items' and, on the last page, 'nextSyncToken'.
+        """
+        service = self.calendar_service.service
+        if page_size or params.get("maxResults"):
+            params["maxResults"] = min(int(page_size or params["maxResults"]), LIST_MAX_PAGE_SIZE)
+        # Top-level metadata the callers use, the rest of the list resource (etag, accessRole, defaultReminders...) is dropped
+        params["fields"] = f"nextPageToken,nextSyncToken,timeZone,items({fields})" if fields else "nextPageToken,nextSyncToken,timeZone,items"
+        page_token = None
+        while True:
+            request = service.events().list(pageToken=page_token, **params)
+            # Google only compresses responses for clients that say "gzip" in their user agent as well
+            request.headers["accept-encoding"] = "gzip"
+            request.headers["user-agent"] = f"{request.headers.get('user-agent', '')} (gzip)".strip()
+            page = await self.execute(request)
+            yield page
+            page_token = page.get("nextPageToken")
+            if not page_token:
+                return
+
+    async def list_events(self, fields=EVENT_QUERY_FIELDS, limit=None, **params):
+        """
+        Iterate over every event matching an events().list query, following nextPageToken lazily.
+
+        :param fields: Partial-response mask for each event. None returns full events.
+        :param limit: Stop after this many events. Also caps the page size, so nothing beyond it is downloaded.
+        :param params: events().list parameters.
+        :return: Async iterator of event dicts.
+        """
+        count = 0
+        async for page in self.list_pages(fields, limit, **params):
+            for event in page.get("items", []):
+                yield event
+                count += 1
+                if limit is not None and count >= limit:
+                    return
+
 
 # Testing the class
 if __name__ == "__main__":
-    calendar_service = GoogleCalendarService()
+    calendar_service = get_calendar_service()
     events = calendar_service.get_upcoming_events()
     calendar_service.print_events(events)
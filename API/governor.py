@@ -0,0 +1,225 @@
+import asyncio
+import os
+import random
+import time
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from google.api_core import exceptions as google_exceptions
+from googleapiclient.errors import HttpError
+
+# Quotas, defaults are the Gemini 1.5 Flash free tier and Calendar's 600 requests per minute per user
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", 15))
+GEMINI_TPM = float(os.getenv("GEMINI_TPM", 1_000_000))
+CALENDAR_QPS = float(os.getenv("CALENDAR_QPS", 10))
+
+# Retry and circuit breaker settings shared by both APIs
+MAX_RETRIES = int(os.getenv("API_MAX_RETRIES", 5))
+BASE_DELAY = 0.5  # seconds, doubled on every retry
+MAX_DELAY = 30.0
+FAILURE_THRESHOLD = 5  # consecutive retryable failures before the circuit opens
+RESET_TIMEOUT = 30.0  # seconds the circuit stays open before a single trial call is let through
+
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+RATE_LIMIT_REASONS = {"rateLimitExceeded", "userRateLimitExceeded"}
+
+
+class CircuitOpen(Exception):
+    pass
+
+
+# A request that isn't safe to repeat timed out. It may still be running in its worker thread, or have been applied
+# on the server, so it is never retried
+class AmbiguousTimeout(asyncio.TimeoutError):
+    pass
+
+
+# Classic token bucket, acquire() waits until enough tokens have refilled
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        """
+        :param rate: Tokens added per second.
+        :param capacity: Maximum tokens held, i.e. the burst size.
+        """
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, tokens=1):
+        tokens = min(tokens, self.capacity)  # a request larger than the bucket still has to go through eventually
+        async with self._lock:  # first come, first served
+            self._refill()
+            while self.tokens < tokens:
+                await asyncio.sleep((tokens - self.tokens) / self.rate)
+                self._refill()
+            self.tokens -= tokens
+
+
+# Stops calling an API that keeps failing. After a cool-down it goes half-open: a single trial call is let through while
+# everyone else still gets CircuitOpen, and the trial's outcome closes the circuit or restarts the cool-down.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def before_call(self):
+        """
+        :return: True if this call is the half-open trial.
+        :raises CircuitOpen: While the circuit is open, or half-open with the trial call still running.
+        """
+        if self.opened_at is None:
+            return False
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            raise CircuitOpen(f"{self.name} is failing, not calling it for {self.reset_timeout:.0f}s")
+        if self.trial_in_flight:
+            raise CircuitOpen(f"{self.name} is failing, waiting on a trial call")
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                print(f"Circuit opened for {self.name} after {self.failures} failures")
+            self.opened_at = time.monotonic()  # a failed trial call restarts the cool-down
+
+    def record_abandoned(self):
+        """The trial call was cancelled before it had an outcome, let the next caller make it."""
+        self.trial_in_flight = False
+
+
+def retry_after(error):
+    """
+    :return: Seconds the server asked us to wait, or None if the error doesn't say.
+    """
+    headers = getattr(error, "resp", None)  # googleapiclient HttpError
+    if headers is None and getattr(error, "response", None) is not None:  # google.api_core errors from REST calls
+        headers = getattr(error.response, "headers", None)
+    value = headers.get("retry-after") or headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_retryable_gemini_error(error):
+    return isinstance(error, (
+        asyncio.TimeoutError,
+        google_exceptions.TooManyRequests,
+        google_exceptions.ResourceExhausted,
+        google_exceptions.InternalServerError,
+        google_exceptions.BadGateway,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.GatewayTimeout,
+        google_exceptions.DeadlineExceeded,
+    ))
+
+
+def is_retryable_calendar_error(error):
+    if isinstance(error, AmbiguousTimeout):
+        return False
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status in RETRYABLE_STATUSES:
+        return True
+    # Calendar reports quota errors as 403 with a rate limit reason
+    return error.resp.status == 403 and any(
+        detail.get("reason") in RATE_LIMIT_REASONS for detail in (error.error_details or []) if isinstance(detail, dict)
+    )
+
+
+# Rate limits, retries with jittered exponential backoff and a circuit breaker in front of one API
+class Governor:
+    def __init__(self, name, buckets, is_retryable, max_retries=MAX_RETRIES):
+        """
+        :param name: API name, used in messages.
+        :param buckets: Function returning a fresh dict of bucket name -> TokenBucket, called once per key (e.g. per user).
+        :param is_retryable: Function telling whether an exception is worth retrying.
+        :param max_retries: Retries after the first attempt.
+        """
+        self.name = name
+        self.make_buckets = buckets
+        self.is_retryable = is_retryable
+        self.max_retries = max_retries
+        self.buckets = {}
+        self.breakers = {}  # by key like the buckets, so one user exhausting their quota doesn't cut off the others
+
+    async def call(self, attempt, key="default", costs=None):
+        """
+        Run attempt() under the rate limits, retrying retryable failures.
+
+        :param attempt: Coroutine function making the call, invoked again on every retry.
+        :param key: Which set of buckets and circuit breaker to use, e.g. the user for per-user quotas.
+        :param costs: Dict of bucket name -> tokens this call uses. Buckets not listed cost 1.
+        :return: attempt()'s result.
+        :raises CircuitOpen: If the API has been failing for this key and is cooling down.
+        """
+        if key not in self.buckets:
+            self.buckets[key] = self.make_buckets()
+            self.breakers[key] = CircuitBreaker(f"{self.name} ({key})" if key != "default" else self.name)
+        breaker = self.breakers[key]
+        costs = costs or {}
+
+        for retry in range(self.max_retries + 1):
+            trial = breaker.before_call()
+            try:
+                for bucket_name, bucket in self.buckets[key].items():
+                    await bucket.acquire(costs.get(bucket_name, 1))
+                result = await attempt()
+            except asyncio.CancelledError:
+                if trial:
+                    breaker.record_abandoned()
+                raise
+            except Exception as error:
+                if isinstance(error, AmbiguousTimeout):  # the API didn't answer, but the call can't be repeated
+                    breaker.record_failure()
+                    raise
+                if not self.is_retryable(error):
+                    breaker.record_success()  # the API answered, the request itself was bad
+                    raise
+                breaker.record_failure()
+                if retry == self.max_retries:
+                    raise
+                backoff = min(MAX_DELAY, BASE_DELAY * 2 ** retry)
+                delay = retry_after(error) or backoff / 2 + random.uniform(0, backoff / 2)
+                print(f"{self.name} call failed ({error}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                breaker.record_success()
+                return result
+
+
+gemini_governor = Governor(
+    "Gemini",
+    lambda: {
+        "requests": TokenBucket(GEMINI_RPM / 60, GEMINI_RPM),
+        "tokens": TokenBucket(GEMINI_TPM / 60, GEMINI_TPM),
+    },
+    is_retryable_gemini_error
+)
+
+calendar_governor = Governor(
+    "Google Calendar",
+    lambda: {"requests": TokenBucket(CALENDAR_QPS, CALENDAR_QPS)},
+    is_retryable_calendar_error
+)
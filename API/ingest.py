@@ -0,0 +1,78 @@
+import codecs
+import os
+
+# Upload limits
+MAX_UPLOAD_BYTES = int(os.getenv("MAX_UPLOAD_BYTES", 10 * 2**20))
+UPLOAD_CHUNK_SIZE = 64 * 2**10
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+async def upload_file_chunks(file, chunk_size=UPLOAD_CHUNK_SIZE):
+    """Read a FastAPI UploadFile piece by piece instead of all at once."""
+    while chunk := await file.read(chunk_size):
+        yield chunk
+
+
+# Incremental parser that turns a stream of byte chunks into text records as soon as each one is complete
+class UploadReader:
+    def __init__(self, chunks, max_bytes=MAX_UPLOAD_BYTES, encoding="utf-8-sig"):
+        """
+        :param chunks: Async iterable of bytes, e.g. upload_file_chunks(file) or request.stream().
+        :param max_bytes: Upload size limit, UploadTooLarge is raised as soon as it is passed.
+        :param encoding: Text encoding of the upload. The default drops the byte order mark Excel's "CSV UTF-8" and many
+                         Windows ICS exports start with, which would otherwise hide the first line's content.
+        """
+        self.chunks = aiter(chunks)
+        self.max_bytes = max_bytes
+        self.decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self.bytes_read = 0
+        self.record_count = 0
+        self.is_ics = None  # decided from the first line
+
+    def _lines(self, text, final=False):
+        self._buffer += text
+        lines = self._buffer.split("\n")
+        self._buffer = "" if final else lines.pop()
+        return [line.rstrip("\r") for line in lines]
+
+    async def records(self):
+        """
+        Yield one record per line. ICS content lines folded over several physical lines (RFC 5545) are joined back first,
+        so every record is a complete "NAME;PARAMS:VALUE" line.
+        """
+        self._buffer = ""
+        pending = None  # last line, held back because the next one might continue it
+        finished = False
+
+        while not finished:
+            try:
+                chunk = await self.chunks.__anext__()
+                self.bytes_read += len(chunk)
+                if self.bytes_read > self.max_bytes:
+                    raise UploadTooLarge(f"Upload is larger than {self.max_bytes} bytes")
+                lines = self._lines(self.decoder.decode(chunk))
+            except StopAsyncIteration:
+                finished = True
+                lines = self._lines(self.decoder.decode(b"", final=True), final=True)
+
+            for line in lines:
+                if self.is_ics is None:
+                    self.is_ics = line.strip().upper() == "BEGIN:VCALENDAR"
+                if not self.is_ics:  # plain text, nothing can continue a line so hand it out right away
+                    self.record_count += 1
+                    yield line
+                    continue
+                if pending is not None and line[:1] in (" ", "\t"):
+                    pending += line[1:]
+                    continue
+                if pending is not None:
+                    self.record_count += 1
+                    yield pending
+                pending = line
+
+        if pending:
+            self.record_count += 1
+            yield pending
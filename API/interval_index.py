@@ -0,0 +1,101 @@
+from bisect import bisect_right
+
+# In-memory index over time intervals (epoch seconds), answers overlap and free-slot queries in logarithmic time
+class IntervalIndex:
+    def __init__(self, intervals):
+        """
+        :param intervals: Iterable of (start, end, item) tuples, start and end in epoch seconds.
+                          item is whatever the caller wants back from overlap queries, e.g. the event dict.
+        """
+        entries = sorted(intervals, key=lambda entry: (entry[0], entry[1]))
+        self.starts = [entry[0] for entry in entries]
+        self.ends = [entry[1] for entry in entries]
+        self.items = [entry[2] for entry in entries]
+
+        # Implicit balanced interval tree over the start-sorted arrays: the node for [lo, hi) is its midpoint,
+        # and max_end holds the latest end time anywhere in that node's subtree
+        self.max_end = [0] * len(entries)
+        self._build(0, len(entries))
+
+        # Merged, disjoint busy periods for free-slot queries
+        self.busy_starts, self.busy_ends = [], []
+        for start, end in zip(self.starts, self.ends):
+            if self.busy_ends and start <= self.busy_ends[-1]:
+                self.busy_ends[-1] = max(self.busy_ends[-1], end)
+            else:
+                self.busy_starts.append(start)
+                self.busy_ends.append(end)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _build(self, lo, hi):
+        if lo >= hi:
+            return float("-inf")
+        mid = (lo + hi) // 2
+        self.max_end[mid] = max(self.ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        return self.max_end[mid]
+
+    def overlapping(self, start, end):
+        """
+        Items whose interval overlaps [start, end), in start order. O(log n + k) for k results.
+
+        :param start: Range start in epoch seconds.
+        :param end: Range end in epoch seconds.
+        """
+        found = []
+
+        def visit(lo, hi):
+            if lo >= hi:
+                return
+            mid = (lo + hi) // 2
+            if self.max_end[mid] <= start:  # nothing in this subtree ends after the range starts
+                return
+            visit(lo, mid)
+            if self.starts[mid] >= end:  # this node and everything to its right start after the range ends
+                return
+            if self.ends[mid] > start:
+                found.append(self.items[mid])
+            visit(mid + 1, hi)
+
+        visit(0, len(self.starts))
+        return found
+
+    def is_free(self, start, end):
+        """True if nothing in the index overlaps [start, end)."""
+        i = bisect_right(self.busy_ends, start)
+        return i == len(self.busy_starts) or self.busy_starts[i] >= end
+
+    def busy_periods(self, start, end):
+        """
+        Merged busy periods clipped to [start, end). O(log n + k).
+
+        :return: List of (busy_start, busy_end) tuples in epoch seconds.
+        """
+        periods = []
+        i = bisect_right(self.busy_ends, start)
+        while i < len(self.busy_starts) and self.busy_starts[i] < end:
+            periods.append((max(self.busy_starts[i], start), min(self.busy_ends[i], end)))
+            i += 1
+        return periods
+
+    def free_slots(self, start, end, duration):
+        """
+        Gaps of at least `duration` seconds between busy periods inside [start, end). O(log n + k).
+
+        :param start: Window start in epoch seconds.
+        :param end: Window end in epoch seconds.
+        :param duration: Minimum slot length in seconds.
+        :return: List of (slot_start, slot_end) tuples in epoch seconds.
+        """
+        slots = []
+        cursor = start
+        i = bisect_right(self.busy_ends, start)  # first busy period still running after the window starts
+        while i < len(self.busy_starts) and self.busy_starts[i] < end:
+            if self.busy_starts[i] - cursor >= duration:
+                slots.append((cursor, self.busy_starts[i]))
+            cursor = max(cursor, self.busy_ends[i])
+            i += 1
+        if end - cursor >= duration:
+            slots.append((cursor, end))
+        return slots
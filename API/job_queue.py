@@ -0,0 +1,88 @@
+import asyncio
+import itertools
+import os
+
+# Worker count and queue bound for background jobs (simulations, imports)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", 4))
+JOB_MAX_PENDING = int(os.getenv("JOB_MAX_PENDING", 32))
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Bounded priority queue of jobs drained by a fixed number of workers
+class JobQueue:
+    def __init__(self, workers=JOB_WORKERS, max_pending=JOB_MAX_PENDING):
+        """
+        :param workers: Number of jobs that run at the same time.
+        :param max_pending: Jobs allowed to wait for a worker before submit() starts rejecting.
+        """
+        self.worker_count = workers
+        self.max_pending = max_pending
+        self._queue = None
+        self._order = itertools.count()  # keeps FIFO order among jobs of the same priority
+        self._workers = []
+        self.pending = {}  # job id -> coroutine function, waiting for a worker
+        self.running = {}  # job id -> asyncio.Task
+
+    def start(self):
+        """Start the workers, call from inside the running event loop (e.g. app startup)."""
+        # Unbounded, cancelled jobs leave their entry behind until a worker skips it. The bound is on self.pending
+        self._queue = asyncio.PriorityQueue()
+        self._workers = [asyncio.create_task(self._work()) for _ in range(self.worker_count)]
+
+    async def stop(self):
+        """Cancel the workers and every running job."""
+        for task in self._workers + list(self.running.values()):
+            task.cancel()
+        await asyncio.gather(*self._workers, *self.running.values(), return_exceptions=True)
+        self._workers = []
+
+    def submit(self, job_id, job, priority=0):
+        """
+        Queue a job.
+
+        :param job_id: Unique ID, used to cancel the job later.
+        :param job: Coroutine function taking no arguments.
+        :param priority: Lower runs sooner.
+        :raises QueueFull: If max_pending jobs are already waiting.
+        """
+        if len(self.pending) >= self.max_pending:
+            raise QueueFull(f"{self.max_pending} jobs are already waiting")
+        self._queue.put_nowait((priority, next(self._order), job_id))
+        self.pending[job_id] = job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job whether it's waiting or running.
+
+        :return: "pending" or "running" depending on where the job was, None if it is unknown or already finished.
+        """
+        if self.pending.pop(job_id, None) is not None:
+            return "pending"  # its queue entry is skipped when a worker reaches it
+        task = self.running.get(job_id)
+        if task is not None:
+            task.cancel()
+            return "running"
+        return None
+
+    def stats(self):
+        return {"workers": self.worker_count, "pending": len(self.pending), "running": len(self.running), "max_pending": self.max_pending}
+
+    async def _work(self):
+        while True:
+            _, _, job_id = await self._queue.get()
+            try:
+                job = self.pending.pop(job_id, None)
+                if job is None:  # cancelled while waiting
+                    continue
+                task = asyncio.create_task(job())
+                self.running[job_id] = task
+                # wait() doesn't raise when the job is cancelled, only when this worker is
+                await asyncio.wait({task})
+                if not task.cancelled() and task.exception():
+                    print(f"Job {job_id} failed: {task.exception()}")
+            finally:
+                self.running.pop(job_id, None)
+                self._queue.task_done()
@@ -1,10 +1,12 @@
-
 import os
 import google.generativeai as genai
 from dotenv import load_dotenv
 import asyncio
 import json
 import pytz
+from response_cache import get_response_cache
+from governor import gemini_governor
+import progress
 
 # Load environment variables from the .env file
 load_dotenv()
@@ -23,14 +25,160 @@ DEFAULT_CONFIG = {
    "top_k": 64,
    "max_output_tokens": 8192,
    "response_mime_type": "text/plain",
-} 
+}
 
-class ModelInitializer:
-   def __init__(self, system_instruction, model_name=DEFAULT_MODEL, config_mods={}):
-      self.model = genai.GenerativeModel(
+# Seconds to wait on a single Gemini round-trip before giving up on it
+DEFAULT_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", 60))
+# Maximum number of Gemini calls in flight across the whole process
+MAX_IN_FLIGHT = int(os.getenv("GEMINI_MAX_IN_FLIGHT", 8))
+
+# Every GenerativeModel ever built, keyed by (model_name, system_instruction, config), so each one is created once per process
+_models = {}
+
+def get_model(system_instruction, model_name=DEFAULT_MODEL, config_mods={}):
+   """
+   Get the shared GenerativeModel for this configuration, building it on first use.
+
+   :param system_instruction: System instruction for the model.
+   :param model_name: Gemini model name.
+   :param config_mods: Properties to change from DEFAULT_CONFIG.
+   """
+   config = DEFAULT_CONFIG | config_mods
+   key = (model_name, system_instruction, json.dumps(config, sort_keys=True))
+   if key not in _models:
+      _models[key] = genai.GenerativeModel(
          model_name=model_name,
-         generation_config=DEFAULT_CONFIG | config_mods, # simply pass in the properties you want to modify from the default in as a new object
+         generation_config=config, # simply pass in the properties you want to modify from the default in as a new object
          system_instruction=system_instruction
       )
+   return _models[key]
+
+class ModelInitializer:
+   _semaphore = asyncio.Semaphore(MAX_IN_FLIGHT) # shared by every model so concurrent tasks can't exceed the cap
+
+   def __init__(self, system_instruction, model_name=DEFAULT_MODEL, config_mods={}, timeout=DEFAULT_TIMEOUT):
+      self.system_instruction = system_instruction
+      self.model_name = model_name
+      self.config_mods = config_mods
+      self.timeout = timeout
+
+   # The model is looked up lazily in the shared registry, constructing a ModelInitializer costs nothing
+   @property
+   def model(self):
+      return get_model(self.system_instruction, self.model_name, self.config_mods)
+
+   async def warm_up(self, connect=False):
+      """
+      Build the shared model ahead of the first request.
+
+      :param connect: Also make a cheap count_tokens call so the API connection is open before real traffic arrives.
+      """
+      model = self.model
+      if connect:
+         await model.count_tokens_async("warm up")
+
+   # Non-blocking generation, use this from coroutines instead of model.generate_content
+   async def generate(self, prompt, timeout=None, cache=False):
+      """
+      Generate a response without blocking the event loop.
+
+      :param prompt: The prompt (or list of contents) to send to the model.
+      :param timeout: Seconds to wait before the call is cancelled. Defaults to the instance timeout.
+      :param cache: Answer from / store into the on-disk response cache. Only use for prompts where a repeated answer is fine.
+      :return: The model response, same shape as model.generate_content (a CachedResponse with .text on a cache hit).
+      :raises asyncio.TimeoutError: If the model still does not answer within the timeout after retrying.
+      :raises governor.CircuitOpen: If Gemini has been failing and calls are paused.
+      """
+      timeout = self.timeout if timeout is None else timeout
+      key = None
+      if cache and isinstance(prompt, str):
+         response_cache = get_response_cache()
+         key = response_cache.key(self.model_name, self.system_instruction, DEFAULT_CONFIG | self.config_mods, prompt)
+         cached = response_cache.get(key)
+         if cached is not None:
+            return cached
+
+      async def attempt():
+         async with self._semaphore:
+            # wait_for cancels the underlying request if the timeout expires or the caller is cancelled
+            return await asyncio.wait_for(
+               self.model.generate_content_async(prompt, request_options={"timeout": timeout}),
+               timeout=timeout
+            )
+
+      # Rough token estimate (4 characters per token) so the TPM bucket is charged before the call goes out
+      response = await gemini_governor.call(attempt, costs={"tokens": len(str(prompt)) // 4 + 1})
+
+      # Measured token counts, to keep an eye on prompt size
+      usage = getattr(response, "usage_metadata", None)
+      if usage is not None:
+         print(f"Gemini tokens: {usage.prompt_token_count} prompt, {usage.candidates_token_count} response")
+         progress.report("usage", {"prompt_tokens": usage.prompt_token_count, "response_tokens": usage.candidates_token_count})
+
+      if key:
+         try:
+            get_response_cache().set(key, response.text)
+         except ValueError: # .text raises when the response was blocked or empty, nothing worth caching
+            pass
+      return response
+
+   # Streaming generation, for answers shown to the user as they are written
+   async def stream(self, prompt, timeout=None, cache=False):
+      """
+      Generate a response and yield its text piece by piece as Gemini produces it.
+
+      :param prompt: The prompt (or list of contents) to send to the model.
+      :param timeout: Seconds to wait for the stream to start, and then for each further chunk. Defaults to the instance timeout.
+      :param cache: Answer from / store into the on-disk response cache. A cached answer is yielded as a single chunk.
+      :raises asyncio.TimeoutError: If the model still does not start answering within the timeout after retrying,
+                                    or stalls for longer than the timeout in the middle of the answer.
+      :raises governor.CircuitOpen: If Gemini has been failing and calls are paused.
+      """
+      timeout = self.timeout if timeout is None else timeout
+      key = None
+      if cache and isinstance(prompt, str):
+         response_cache = get_response_cache()
+         key = response_cache.key(self.model_name, self.system_instruction, DEFAULT_CONFIG | self.config_mods, prompt)
+         cached = response_cache.get(key)
+         if cached is not None:
+            yield cached.text
+            return
+
+      # Only opening the stream is retried, once text has been handed out a retry would repeat it
+      async def attempt():
+         await self._semaphore.acquire() # held until the stream is finished
+         try:
+            response = await asyncio.wait_for(
+               self.model.generate_content_async(prompt, stream=True, request_options={"timeout": timeout}),
+               timeout=timeout
+            )
+            chunks = aiter(response)
+            first = await asyncio.wait_for(anext(chunks, None), timeout=timeout)
+         except BaseException:
+            self._semaphore.release()
+            raise
+         return response, chunks, first
+
+      response, chunks, chunk = await gemini_governor.call(attempt, costs={"tokens": len(str(prompt)) // 4 + 1})
+      parts = []
+      try:
+         while chunk is not None:
+            try:
+               text = chunk.text
+            except ValueError: # chunks without text (e.g. only safety ratings)
+               text = ""
+            if text:
+               parts.append(text)
+               yield text
+            chunk = await asyncio.wait_for(anext(chunks, None), timeout=timeout)
+      finally:
+         self._semaphore.release()
+
+      usage = getattr(response, "usage_metadata", None)
+      if usage is not None:
+         print(f"Gemini tokens: {usage.prompt_token_count} prompt, {usage.candidates_token_count} response")
+         progress.report("usage", {"prompt_tokens": usage.prompt_token_count, "response_tokens": usage.candidates_token_count})
+      if key and parts:
+         get_response_cache().set(key, "".join(parts))
 
 # SOME MODELS MAY BE MORE CONDUCIVE TO MAKING A CHAT THREAD, BUT SOME MAY BE CONDUCIVE TO SIMPLE "generate_content" CALL
\ No newline at end of file
@@ -0,0 +1,33 @@
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+# Processes for CPU-heavy deterministic work (JSON parsing, slot search). 0 keeps everything on the calling thread.
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", 0))
+# Payloads smaller than this many bytes are handled inline, shipping them to another process costs more than it saves
+OFFLOAD_MIN_BYTES = int(os.getenv("OFFLOAD_MIN_BYTES", 256 * 2**10))
+
+_pool = None
+
+def get_process_pool():
+    """The process-wide pool, started on first use. Uses spawn so worker processes don't inherit our threads."""
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+async def run_cpu(func, *args, size=None):
+    """
+    Run a CPU-bound function in the process pool so the event loop stays responsive.
+
+    :param func: A module-level (picklable) function. Its arguments and result cross the process boundary,
+                 so keep them compact: strings, bytes, ints or NumPy arrays rather than nested dicts.
+    :param args: Arguments for func.
+    :param size: Approximate payload size in bytes. Below OFFLOAD_MIN_BYTES, func runs inline.
+    :return: Whatever func returns.
+    """
+    if PROCESS_WORKERS <= 0 or (size is not None and size < OFFLOAD_MIN_BYTES):
+        return func(*args)
+    return await asyncio.get_running_loop().run_in_executor(get_process_pool(), func, *args)
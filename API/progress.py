@@ -0,0 +1,62 @@
+import asyncio
+import contextvars
+
+# Channel of the task currently running, set by the server so agents can report steps without passing it around
+current_channel = contextvars.ContextVar("progress_channel", default=None)
+
+# Push-based progress for one task, any number of subscribers, resumable by sequence number
+class ProgressChannel:
+    def __init__(self):
+        self.messages = []  # full history, index == sequence number, so reconnecting clients can catch up
+        self.done = False
+        self._changed = asyncio.Event()
+
+    def publish(self, kind, data, final=False):
+        """
+        Append a message and wake every subscriber.
+
+        :param kind: Message type, e.g. 'step', 'chunk', 'result' or 'error'.
+        :param data: JSON-serializable payload.
+        :param final: Marks the last message of the task.
+        """
+        if self.done:
+            return
+        self.messages.append({"seq": len(self.messages), "type": kind, "data": data})
+        self.done = final
+        # Swap in a fresh event before setting the old one, so waiters wake exactly once per publish
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def subscribe(self, since=0):
+        """
+        Yield messages from sequence number `since` onwards as they are published, until the final one.
+        """
+        index = since
+        while True:
+            while index < len(self.messages):
+                yield self.messages[index]
+                index += 1
+            if self.done:
+                return
+            await self._changed.wait()
+
+
+def report(kind, data):
+    """Publish to the current task's channel, if the caller is running inside one."""
+    channel = current_channel.get()
+    if channel is not None:
+        channel.publish(kind, data)
+
+
+# Channels by task ID
+channels = {}
+
+def open_channel(task_id):
+    channels[task_id] = ProgressChannel()
+    return channels[task_id]
+
+def get_channel(task_id):
+    return channels.get(task_id)
+
+def close_channel(task_id):
+    channels.pop(task_id, None)
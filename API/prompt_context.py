@@ -0,0 +1,69 @@
+import json
+import os
+import re
+from datetime import datetime, timezone
+
+# Tokens of event context allowed in a single prompt
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 2000))
+# Gemini averages about 4 characters per token for English and JSON
+CHARS_PER_TOKEN = 4
+
+_WORDS = re.compile(r"[a-z0-9]+")
+_STOP_WORDS = {"a", "an", "the", "to", "on", "at", "in", "of", "for", "my", "me", "i", "and", "from", "with", "is", "it", "please"}
+
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _words(text):
+    return {word for word in _WORDS.findall(text.lower()) if word not in _STOP_WORDS}
+
+
+def rank_events(events, query, now=None):
+    """
+    Order events by how likely the query is about them: words shared with the summary or location first,
+    then closeness to now.
+
+    :param events: List of Event.
+    :param query: The user's instruction.
+    :param now: Aware datetime, defaults to the current time.
+    """
+    now = (now or datetime.now(timezone.utc)).timestamp()
+    query_words = _words(query or "")
+
+    def score(event):
+        overlap = len(query_words & _words(f"{event.summary} {event.location or ''}"))
+        return (-overlap, abs(event.start - now))
+
+    return sorted(events, key=score)
+
+
+def events_context(events, time_zone, query=None, budget=PROMPT_TOKEN_BUDGET):
+    """
+    Serialize events for a prompt within a token budget. When the budget is too small for all of them,
+    the most relevant ones are kept.
+
+    :param events: List of Event, in the order they should appear (e.g. by start time).
+    :param time_zone: The calendar's timezone, times are written in it.
+    :param query: The user's instruction, used for ranking. Without it the first events are kept.
+    :param budget: Maximum estimated tokens for the returned text.
+    :return: (text, included) where text has one compact JSON event per line and included is the number of events in it.
+    """
+    lines = {}  # position in events -> serialized event
+    used = 0
+    ranked = rank_events(events, query) if query is not None else events
+    positions = {id(event): position for position, event in enumerate(events)}
+    for event in ranked:
+        # Only what the model needs to talk about or pick an event, see Event.to_prompt
+        line = json.dumps(event.to_prompt(time_zone), separators=(",", ":"), ensure_ascii=False)
+        cost = estimate_tokens(line)
+        if used + cost > budget:
+            break
+        lines[positions[id(event)]] = line
+        used += cost
+
+    text = "\n".join(lines[position] for position in sorted(lines))
+    if len(lines) < len(events):
+        text += f"\n({len(events) - len(lines)} less relevant events omitted)"
+    return text, len(lines)
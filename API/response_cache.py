@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+import re
+import diskcache
+
+# On-disk cache for Gemini responses, shared by every worker process on the machine
+CACHE_DIR = os.getenv("LLM_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".llm_cache"))
+CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 3600))  # seconds
+CACHE_SIZE_LIMIT = int(os.getenv("LLM_CACHE_SIZE_LIMIT", 256 * 2**20))  # bytes
+
+# Agents tell the model "Right now it is <datetime.now().isoformat()> in <timezone>". Only that clock is truncated, to the
+# minute, so the same question asked twice can hit. Every other timestamp (event times, query bounds) is part of the answer.
+CURRENT_TIME = re.compile(r"(Right now it is \d{4}-\d{2}-\d{2}T\d{2}:\d{2})(?::\d{2}(?:\.\d+)?)?")
+
+
+def normalize_prompt(prompt):
+    """Truncate the current time an agent embeds in its prompt to the minute, the rest of the prompt is kept as is."""
+    return CURRENT_TIME.sub(r"\1", prompt)
+
+
+# Stand-in for a Gemini response when the answer comes from the cache, callers only read .text
+class CachedResponse:
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        return f"CachedResponse(text={self.text!r})"
+
+
+# Content-addressed response cache with TTL and LRU eviction
+class ResponseCache:
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, size_limit=CACHE_SIZE_LIMIT):
+        """
+        :param directory: Where the cache lives on disk.
+        :param ttl: Seconds an entry stays valid.
+        :param size_limit: Bytes on disk before least recently used entries are evicted.
+        """
+        self.ttl = ttl
+        self.cache = diskcache.Cache(directory, size_limit=size_limit, eviction_policy="least-recently-used")
+        self.cache.stats(enable=True)  # hit/miss counters are kept by diskcache, across processes
+
+    def key(self, model_name, system_instruction, config, prompt):
+        """
+        :return: Hex digest identifying the request, independent of when in the minute it was made.
+        """
+        payload = json.dumps(
+            [model_name, normalize_prompt(system_instruction or ""), config, normalize_prompt(prompt)],
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        :return: A CachedResponse, or None on a miss.
+        """
+        text = self.cache.get(key)
+        return CachedResponse(text) if text is not None else None
+
+    def set(self, key, text):
+        self.cache.set(key, text, expire=self.ttl)
+
+    def stats(self):
+        """
+        :return: Dict with hits, misses, hit rate, entry count and bytes on disk.
+        """
+        hits, misses = self.cache.stats()
+        return {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / (hits + misses) if hits + misses else 0.0,
+            "entries": len(self.cache),
+            "bytes": self.cache.volume(),
+        }
+
+
+_response_cache = None
+
+def get_response_cache():
+    """The process-wide ResponseCache, opened on first use."""
+    global _response_cache
+    if _response_cache is None:
+        _response_cache = ResponseCache()
+    return _response_cache
@@ -1,11 +1,45 @@
-from fastapi import FastAPI, WebSocket, UploadFile, File
+from fastapi import FastAPI, WebSocket, UploadFile, File, Request, HTTPException, Header, Depends
 import asyncio
 import uuid
+from functools import partial
 import simulate_classroom as sc
+import progress
+from task_store import create_task_store, TASK_TTL
+from ingest import UploadReader, UploadTooLarge, upload_file_chunks
+from bulk_import import BulkImporter
+from gcal_service import get_calendar_service, NotAuthenticated
+from credential_store import create_credential_store, DEFAULT_USER
+from central_agent import CentralAgent
+from user_auth import verify_session, InvalidSession
+from job_queue import JobQueue, QueueFull
+from contextlib import asynccontextmanager
 from fastapi.middleware.cors import CORSMiddleware
 
+# Bounded queue and worker pool every simulation and import runs through
+job_queue = JobQueue()
+
+async def warm_up():
+    """
+    Authorize the default user's Calendar client and warm the agents on it (models, timezone, event store)
+    before the first request arrives. Skipped when the user never logged in, a server must not open the browser login.
+    """
+    if create_credential_store().load(DEFAULT_USER) is None:
+        return
+    try:
+        calendar_service = await asyncio.to_thread(get_calendar_service)
+        await CentralAgent(calendar_service).warm_up()
+    except Exception as e:
+        print(f"Warm-up failed, clients are built on first use instead: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    job_queue.start()
+    await warm_up()
+    yield
+    await job_queue.stop()
+
 # Initialize the FastAPI app
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Configure Cross-Origin Resource Sharing (CORS) Middleware
 # This configuration allows requests from any origin, with any method, and any header.
@@ -17,68 +51,275 @@ app.add_middleware(
     allow_headers=["*"],  # Allows all headers
 )
 
-# In-memory dictionary to store the status and result of simulation tasks
-tasks = {}
+# Store for the status and result of simulation tasks, bounded and evicting (see task_store.py to pick a backend)
+tasks = create_task_store()
 
-@app.post("/upload/")
-async def upload_and_start_simulation(file: UploadFile = File(...)):
+def start_task():
     """
-    Endpoint to upload a file and start a simulation task.
-    Generates a unique task ID for each upload and initiates an asynchronous simulation task.
-    :param file: The file uploaded by the client.
-    :return: A dictionary containing the task ID and a message indicating the simulation has started.
+    Register a new task and open its progress channel.
+    :return: The unique ID of the task.
     """
     # Generate a unique ID for the task
     task_id = str(uuid.uuid4())
 
-    # Initialize task status and result in the tasks dictionary
-    tasks[task_id] = {
+    # Initialize task status and result in the task store
+    tasks.set(task_id, {
         "status": "in progress",
         "result": None
-    }
+    })
+    progress.open_channel(task_id)
+    return task_id
+
+def finish_task(task_id: str, status: str, result):
+    """
+    Record a task's final state and push it to the websocket subscribers.
+    :param task_id: Unique ID of the task.
+    :param status: "completed" or "failed".
+    :param result: The task's result, or {"error": ...} for failures.
+    """
+    tasks.update(task_id, status=status, result=result)
+    channel = progress.get_channel(task_id)
+    if channel:
+        channel.publish("error" if status == "failed" else "result", result, final=True)
+    # Keep the channel around for reconnects as long as the task itself is kept, the store has the result after that
+    asyncio.get_running_loop().call_later(TASK_TTL, progress.close_channel, task_id)
+
+def cancel_task(task_id: str):
+    """
+    Cancel a queued or running task.
+    :return: True if the task was cancelled, False if it is unknown or already finished.
+    """
+    state = job_queue.cancel(task_id)
+    if state == "pending":  # never started, so nothing else will record the cancellation
+        finish_task(task_id, "failed", {"error": "cancelled"})
+    return state is not None
+
+async def ingest_upload(task_id: str, chunks, run=None, priority: int = 0):
+    """
+    Parse the upload incrementally and feed its records to the task as they complete, so work starts before
+    the whole file has been read. The job is queued once the first record arrives, a client that stalls before
+    sending anything doesn't hold a worker.
+    :param task_id: Unique ID of the task.
+    :param chunks: Async iterable of the upload's bytes.
+    :param run: Coroutine function (task_id, records queue) doing the work. Defaults to run_simulation.
+    :param priority: Job priority, lower runs sooner.
+    :raises HTTPException: 429 if the job queue is full, 413 if the upload is larger than MAX_UPLOAD_BYTES.
+    """
+    records = asyncio.Queue()
+    queued = False
+
+    def queue_job():
+        try:
+            job_queue.submit(task_id, lambda: (run or run_simulation)(task_id, records), priority)
+        except QueueFull as e:
+            tasks.delete(task_id)
+            progress.close_channel(task_id)
+            raise HTTPException(status_code=429, detail=str(e))
+
+    def abort(error):
+        # The job never gets its end marker, so it must not be left waiting on the queue (and holding a worker)
+        if queued:
+            cancel_task(task_id)
+        else:
+            finish_task(task_id, "failed", {"error": error})
+
+    reader = UploadReader(chunks)
+    try:
+        async for record in reader.records():
+            records.put_nowait(record)
+            if not queued:
+                queue_job()
+                queued = True
+        if not queued:  # empty upload
+            queue_job()
+            queued = True
+        records.put_nowait(None)  # end of upload
+    except HTTPException:
+        raise
+    except UploadTooLarge as e:
+        abort(str(e))
+        raise HTTPException(status_code=413, detail=str(e))
+    except BaseException as e:  # client disconnected, read error, request cancelled
+        abort(f"upload failed: {e!r}")
+        raise
+
+    # Log file receipt without dumping its content
+    print(f"received file upload: {reader.bytes_read} bytes, {reader.record_count} records")
 
-    # Read and decode the content of the uploaded file
-    content = await file.read()
-    file_string = content.decode('utf-8')
+@app.post("/upload/")
+async def upload_and_start_simulation(file: UploadFile = File(...), priority: int = 0):
+    """
+    Endpoint to upload a file and start a simulation task.
+    Generates a unique task ID for each upload and queues an asynchronous simulation task.
+    :param file: The file uploaded by the client.
+    :param priority: Job priority, lower runs sooner.
+    :return: A dictionary containing the task ID and a message indicating the simulation has started.
+    """
+    task_id = start_task()
+    await ingest_upload(task_id, upload_file_chunks(file), priority=priority)
+    return {"task_id": task_id, "message": "Simulation started"}
 
-    # Log file receipt and start the simulation in an asynchronous task
-    print("received file upload:", file_string)
-    asyncio.create_task(run_simulation(task_id, file_string))
-    
+@app.post("/upload/stream/")
+async def stream_and_start_simulation(request: Request, priority: int = 0):
+    """
+    Endpoint for large files sent as the raw request body (e.g. text/plain or text/calendar).
+    Unlike /upload/ the body isn't spooled first, records are handed to the simulation while the upload is still arriving.
+    :param request: The incoming request, its body is the file.
+    :param priority: Job priority, lower runs sooner.
+    :return: A dictionary containing the task ID and a message indicating the simulation has started.
+    """
+    task_id = start_task()
+    await ingest_upload(task_id, request.stream(), priority=priority)
     return {"task_id": task_id, "message": "Simulation started"}
 
-async def run_simulation(task_id: str, content: str):
+async def session_user(authorization: str = Header(None)):
+    """
+    Dependency resolving the user a request acts for from its signed session token (see user_auth.py).
+    :param authorization: "Bearer <token>" header.
+    :return: The user ID.
+    :raises HTTPException: 401 if the token is missing, forged or expired.
+    """
+    if not authorization or not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing session token", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        return verify_session(authorization[len("Bearer "):])
+    except InvalidSession as e:
+        raise HTTPException(status_code=401, detail=str(e), headers={"WWW-Authenticate": "Bearer"})
+
+@app.post("/import/")
+async def upload_and_start_import(file: UploadFile = File(...), priority: int = 0, user_id: str = Depends(session_user)):
+    """
+    Endpoint to bulk import an ICS or CSV file (e.g. a semester class schedule) into the user's calendar.
+    Records are parsed locally and written in batches, no LLM call is made. The websocket for the returned
+    task ID delivers a summary: {"imported": n, "skipped": n, "failed": [...]}.
+    :param file: The ICS or CSV file uploaded by the client.
+    :param priority: Job priority, lower runs sooner.
+    :param user_id: Whose calendar to import into, taken from the verified session token, never from the client's say-so.
+    :return: A dictionary containing the task ID and a message indicating the import has started.
+    """
+    # Warm clients are reused, a user's first request authenticates off the event loop
+    try:
+        calendar_service = await asyncio.to_thread(get_calendar_service, user_id)
+    except NotAuthenticated as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    task_id = start_task()
+    await ingest_upload(task_id, upload_file_chunks(file), partial(run_import, calendar_service=calendar_service), priority)
+    return {"task_id": task_id, "message": "Import started"}
+
+async def queued_records(records: asyncio.Queue):
+    """Iterate an ingest queue until its end marker."""
+    while (record := await records.get()) is not None:
+        yield record
+
+async def run_import(task_id: str, records: asyncio.Queue, calendar_service):
+    """
+    Asynchronous function to run a bulk import, consuming records while the upload is still being read.
+    :param task_id: Unique ID of the task.
+    :param records: Queue of the uploaded file's records (lines), ended by None.
+    :param calendar_service: The user's GoogleCalendarService, the events go into their calendar.
+    """
+    try:
+        result = await BulkImporter(calendar_service).import_records(queued_records(records))
+    except asyncio.CancelledError:
+        finish_task(task_id, "failed", {"error": "cancelled"})
+        raise
+    except Exception as e:
+        finish_task(task_id, "failed", {"error": str(e)})
+        print(f"Import {task_id} failed: {e}")
+    else:
+        finish_task(task_id, "completed", result)
+
+async def run_simulation(task_id: str, records: asyncio.Queue):
     """
     Asynchronous function to run the simulation.
-    Updates the task's status and result in the global tasks dictionary upon completion.
+    Updates the task's status and result in the task store upon completion.
     :param task_id: Unique ID of the task.
-    :param content: Content of the uploaded file to simulate.
+    :param records: Queue of the uploaded file's records (lines), ended by None.
     """
+    # Agents report their steps to this task's channel through the context variable
+    progress.current_channel.set(progress.get_channel(task_id))
+
     # Perform simulation and store the result
-    result = await sc.simulate_classroom(content)
-    tasks[task_id]["status"] = "completed"
-    tasks[task_id]["result"] = result
+    try:
+        lines = [record async for record in queued_records(records)]
+        result = await sc.simulate_classroom("\n".join(lines))
+    except asyncio.CancelledError:
+        finish_task(task_id, "failed", {"error": "cancelled"})
+        raise
+    except Exception as e:
+        finish_task(task_id, "failed", {"error": str(e)})
+        print(f"Simulation {task_id} failed: {e}")
+    else:
+        finish_task(task_id, "completed", result)
+
+@app.delete("/tasks/{task_id}")
+async def cancel_task_endpoint(task_id: str):
+    """
+    Endpoint to cancel a queued or running task. Subscribers receive {"error": "cancelled"}.
+    :param task_id: The task ID to cancel.
+    :return: A dictionary containing the task ID and a message.
+    """
+    if not cancel_task(task_id):
+        raise HTTPException(status_code=404, detail="Task not found or already finished")
+    return {"task_id": task_id, "message": "Task cancelled"}
+
+@app.get("/jobs/")
+async def job_stats():
+    """
+    Endpoint reporting the job queue's load and the task store's size.
+    """
+    return {"jobs": job_queue.stats(), "tasks": tasks.size()}
+
+async def wait_for_stored_result(task_id: str):
+    """
+    Wait for a task that runs in another worker process, by checking the shared task store with backoff.
+    :param task_id: Unique ID of the task.
+    :return: The finished task, or None if it disappeared from the store.
+    """
+    delay = 0.1
+    while True:
+        task = tasks.get(task_id)
+        if task is None or task["status"] != "in progress":
+            return task
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 2.0)
 
 @app.websocket("/ws/{task_id}")
-async def websocket_endpoint(websocket: WebSocket, task_id: str):
+async def websocket_endpoint(websocket: WebSocket, task_id: str, updates: bool = False, since: int = 0):
     """
     WebSocket endpoint to stream the status and result of the simulation task.
+    Messages are pushed the moment they're published, there is no polling.
     :param websocket: The WebSocket connection instance.
     :param task_id: The task ID for which status and result are to be streamed.
+    :param updates: If true, every message ({"seq", "type", "data"}) is sent, including intermediate agent steps.
+                    Otherwise only the final result is sent, as before.
+    :param since: Sequence number to resume from after a reconnect (only with updates).
     """
     await websocket.accept()
     try:
-        # Retrieve the task based on task_id
+        # Retrieve the task and its progress channel based on task_id
         task = tasks.get(task_id)
+        channel = progress.get_channel(task_id)
 
         # Check if task exists and stream updates
         if not task:
             await websocket.send_text("Task not found")
             return
-        while task["status"] == "in progress":
-            print("in-progress")
-            await asyncio.sleep(1)
-        await websocket.send_json(task["result"])
+        if not channel:
+            # The task runs (or ran) in another worker, only its final state is available
+            task = await wait_for_stored_result(task_id)
+            if task is None:
+                await websocket.send_text("Task not found")
+            elif updates:
+                await websocket.send_json({"seq": None, "type": "error" if task["status"] == "failed" else "result", "data": task["result"]})
+            else:
+                await websocket.send_json(task["result"])
+            return
+        async for message in channel.subscribe(since if updates else 0):
+            if updates:
+                await websocket.send_json(message)
+            elif message["type"] in ("result", "error"):
+                await websocket.send_json(message["data"])
     finally:
         # Close the WebSocket connection
         print("websocket closing")
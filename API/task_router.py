@@ -0,0 +1,119 @@
+import json
+import re
+import textwrap
+from datetime import date
+from model_initializer import ModelInitializer
+from offload import run_cpu
+
+TASK_TYPES = ["retrieve events", "retrieve free times", "schedule", "edit", "import", "unknown task"]
+AGENTS = ["GcalScraper", "EventInitializer", "EventEditor", "BulkImporter"]
+
+# Response schema for JSON mode, so Gemini can only answer with a well-formed task list
+TASK_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "tasks": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "task": {"type": "string"},
+                    "type": {"type": "string", "enum": TASK_TYPES},
+                    "agent": {"type": "string", "enum": AGENTS},
+                    "date": {"type": "string", "nullable": True},  # YYYY-MM-DD
+                    "eventDetails": {"type": "string", "nullable": True},
+                },
+                "required": ["task", "type", "agent"],
+            },
+        },
+    },
+    "required": ["tasks"],
+}
+
+# Header columns that mark pasted text as a calendar CSV export
+CSV_DATE_COLUMNS = {"start", "start date"}
+CSV_TITLE_COLUMNS = {"summary", "subject", "title"}
+
+_SEPARATORS = re.compile(r"[\s,]*")
+
+
+def classify_input(input_text):
+    """
+    Recognize inputs that don't need a model to be understood.
+
+    :return: A list of tasks, or None if the input has to go to the model.
+    """
+    stripped = input_text.lstrip().lstrip("\ufeff").lstrip()  # text pasted from a file may keep its byte order mark
+    first_line = stripped.split("\n", 1)[0].strip().lower()
+    columns = {column.strip().strip('"') for column in first_line.split(",")}
+    if stripped[:15].upper() == "BEGIN:VCALENDAR" or (columns & CSV_DATE_COLUMNS and columns & CSV_TITLE_COLUMNS):
+        return [{"task": "Import events from the pasted calendar file", "type": "import", "agent": "BulkImporter", "date": None, "eventDetails": None}]
+    return None
+
+
+def _salvage_tasks(text):
+    """Pull every complete task object out of output that was cut off or otherwise broken."""
+    match = re.search(r'"tasks"\s*:\s*\[|^\s*\[', text)
+    if not match:
+        return []
+    decoder = json.JSONDecoder()
+    tasks = []
+    position = match.end()
+    while True:
+        position = _SEPARATORS.match(text, position).end()
+        try:
+            task, position = decoder.raw_decode(text, position)
+        except json.JSONDecodeError:
+            return tasks  # everything from here on is incomplete
+        tasks.append(task)
+
+
+def parse_tasks(text):
+    """
+    Parse the model's task list, keeping what's usable instead of discarding the whole answer.
+
+    :param text: Model output, normally {"tasks": [...]}.
+    :return: List of valid task dicts, possibly empty.
+    """
+    try:
+        parsed = json.loads(text)
+        tasks = parsed.get("tasks", []) if isinstance(parsed, dict) else parsed
+    except json.JSONDecodeError:
+        tasks = _salvage_tasks(text)
+    if not isinstance(tasks, list):
+        return []
+    return [task for task in tasks if isinstance(task, dict) and task.get("type") in TASK_TYPES]
+
+
+# Turns user input into the task list the CentralAgent runs, using the model only when it has to
+class TaskRouter:
+    def __init__(self):
+        self.model_init = ModelInitializer(
+            textwrap.dedent("""
+                You route calendar requests to agents. Break the user's input down into tasks.
+                Use the GcalScraper for retrieving events ("retrieve events") or free times ("retrieve free times"),
+                the EventInitializer for scheduling or creating new events ("schedule"),
+                and the EventEditor for editing or deleting existing events ("edit").
+                Give every task its date as YYYY-MM-DD when the input implies one, and put everything the agent
+                needs to know about the event (title, times, recurrence, which event to change) in eventDetails.
+                Use "unknown task" for anything that isn't about the calendar.
+            """),
+            config_mods={"response_mime_type": "application/json", "response_schema": TASK_SCHEMA}
+        )
+
+    async def route(self, input_text):
+        """
+        :param input_text: The user's request.
+        :return: List of task dicts with task, type, agent, date and eventDetails.
+        """
+        tasks = classify_input(input_text)
+        if tasks is not None:
+            return tasks
+
+        response = await self.model_init.generate(f'Today is {date.today().isoformat()}. Input: "{input_text}"', cache=True)
+        try:
+            text = response.text
+        except ValueError:  # blocked or empty response
+            return []
+        # Large breakdowns are parsed off the event loop
+        return await run_cpu(parse_tasks, text, size=len(text))
@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+# Maximum number of tasks from one request that may run at the same time
+MAX_CONCURRENT_TASKS = int(os.getenv("MAX_CONCURRENT_TASKS", 4))
+
+# (reads existing events, writes events) for every task type the CentralAgent understands
+TASK_ACCESS = {
+    "retrieve events": (True, False),
+    "retrieve free times": (True, False),
+    "schedule": (False, True),  # creating an event doesn't depend on what else is on the calendar
+    "edit": (True, True),       # edits pick an existing event, then change it
+    "import": (True, True),     # imports skip events that already exist
+}
+
+# Dependency-aware scheduler, runs independent tasks concurrently and keeps order only where it matters
+class TaskScheduler:
+    def __init__(self, handler, max_concurrency=MAX_CONCURRENT_TASKS):
+        """
+        :param handler: Coroutine function called with a single task dict.
+        :param max_concurrency: Maximum number of tasks running at once.
+        """
+        self.handler = handler
+        self.max_concurrency = max_concurrency
+
+    @staticmethod
+    def _access(task):
+        return TASK_ACCESS.get(task.get("type"), (False, False))
+
+    @staticmethod
+    def _same_window(first, second):
+        """Tasks without a date may touch any day, so they overlap with everything."""
+        first_date, second_date = first.get("date"), second.get("date")
+        return not first_date or not second_date or first_date == second_date
+
+    def conflicts(self, earlier, later):
+        """
+        A later task must wait for an earlier one when one of them reads what the other writes on the same day,
+        e.g. an edit after a create, or a create after a lookup the user asked for first.
+        """
+        earlier_reads, earlier_writes = self._access(earlier)
+        later_reads, later_writes = self._access(later)
+        if not ((earlier_writes and later_reads) or (earlier_reads and later_writes)):
+            return False
+        return self._same_window(earlier, later)
+
+    def dependencies(self, tasks):
+        """
+        :param tasks: List of task dicts in the order the user gave them.
+        :return: List where entry i is the set of indices task i has to wait for.
+        """
+        return [
+            {j for j in range(i) if self.conflicts(tasks[j], tasks[i])}
+            for i in range(len(tasks))
+        ]
+
+    async def run(self, tasks):
+        """
+        Run all tasks, overlapping the independent ones.
+
+        :param tasks: List of task dicts.
+        :return: List of results in task order. A failed task's entry is the exception it raised.
+        """
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        runners = []
+
+        async def run_one(task, deps):
+            # Wait for earlier conflicting tasks even if they failed, ordering is what matters here
+            if deps:
+                await asyncio.gather(*deps, return_exceptions=True)
+            async with semaphore:
+                return await self.handler(task)
+
+        for task, deps in zip(tasks, self.dependencies(tasks)):
+            runners.append(asyncio.create_task(run_one(task, [runners[j] for j in deps])))
+
+        results = await asyncio.gather(*runners, return_exceptions=True)
+        for task, result in zip(tasks, results):
+            if isinstance(result, Exception):
+                print(f"Task failed: {task} ({result})")
+        return results
@@ -0,0 +1,115 @@
+import json
+import os
+import time
+from collections import OrderedDict
+import diskcache
+
+# Limits for stored tasks, finished or not
+TASK_TTL = float(os.getenv("TASK_TTL", 3600))  # seconds a task is kept after its last write
+TASK_MAX_ENTRIES = int(os.getenv("TASK_MAX_ENTRIES", 1000))
+TASK_MAX_BYTES = int(os.getenv("TASK_MAX_BYTES", 64 * 2**20))
+# "memory" keeps tasks in this process only, "disk" shares them between worker processes on the same machine
+TASK_STORE = os.getenv("TASK_STORE", "memory")
+TASK_STORE_DIR = os.getenv("TASK_STORE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".task_store"))
+
+
+# Interface every task store implements, tasks are JSON-serializable dicts
+class TaskStore:
+    def get(self, task_id):
+        """:return: The task dict, or None if it doesn't exist or was evicted."""
+        raise NotImplementedError
+
+    def set(self, task_id, task):
+        raise NotImplementedError
+
+    def delete(self, task_id):
+        raise NotImplementedError
+
+    def size(self):
+        """:return: Dict with the number of entries and the bytes they take up."""
+        raise NotImplementedError
+
+    def update(self, task_id, **fields):
+        """Change some fields of a stored task. Read-modify-write, so only the task's owner should call it."""
+        task = self.get(task_id)
+        if task is not None:
+            task.update(fields)
+            self.set(task_id, task)
+        return task
+
+    def __contains__(self, task_id):
+        return self.get(task_id) is not None
+
+
+# In-process store with TTL and LRU eviction by entry count and serialized size
+class MemoryTaskStore(TaskStore):
+    def __init__(self, ttl=TASK_TTL, max_entries=TASK_MAX_ENTRIES, max_bytes=TASK_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()  # task id -> (expires at, bytes, task), least recently used first
+        self.bytes = 0
+
+    def get(self, task_id):
+        entry = self.entries.get(task_id)
+        if entry is None:
+            return None
+        if entry[0] < time.monotonic():
+            self.delete(task_id)
+            return None
+        self.entries.move_to_end(task_id)
+        return entry[2]
+
+    def set(self, task_id, task):
+        self.delete(task_id)
+        size = len(json.dumps(task, default=str))
+        self.entries[task_id] = (time.monotonic() + self.ttl, size, task)
+        self.bytes += size
+        self._evict()
+
+    def delete(self, task_id):
+        entry = self.entries.pop(task_id, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+
+    def _evict(self):
+        now = time.monotonic()
+        for task_id in [task_id for task_id, entry in self.entries.items() if entry[0] < now]:
+            self.delete(task_id)
+        # Always keep the newest task, even if it alone is over the byte limit
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            self.delete(next(iter(self.entries)))
+
+    def size(self):
+        return {"entries": len(self.entries), "bytes": self.bytes}
+
+
+# Durable store on diskcache, shared by every worker process pointed at the same directory
+class DiskTaskStore(TaskStore):
+    def __init__(self, directory=TASK_STORE_DIR, ttl=TASK_TTL, max_bytes=TASK_MAX_BYTES):
+        self.ttl = ttl
+        self.cache = diskcache.Cache(directory, size_limit=max_bytes, eviction_policy="least-recently-used")
+
+    def get(self, task_id):
+        return self.cache.get(task_id)
+
+    def set(self, task_id, task):
+        self.cache.set(task_id, task, expire=self.ttl)
+
+    def delete(self, task_id):
+        self.cache.delete(task_id)
+
+    def size(self):
+        return {"entries": len(self.cache), "bytes": self.cache.volume()}
+
+
+def create_task_store(kind=TASK_STORE):
+    """
+    :param kind: "memory" or "disk".
+    :return: A new task store of that kind.
+    """
+    if kind == "disk":
+        return DiskTaskStore()
+    if kind == "memory":
+        return MemoryTaskStore()
+    raise ValueError(f"Unknown task store: {kind}")
@@ -0,0 +1,68 @@
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+
+# Key the server signs session tokens with. Without it no session verifies, so endpoints acting on a user's calendar refuse every request
+SESSION_SECRET = os.getenv("SESSION_SECRET", "")
+SESSION_TTL = float(os.getenv("SESSION_TTL", 12 * 3600))  # seconds
+
+
+class InvalidSession(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload, secret):
+    return hmac.new(secret.encode("utf-8"), payload, hashlib.sha256).digest()
+
+
+def issue_session(user_id, ttl=SESSION_TTL, secret=SESSION_SECRET):
+    """
+    Sign a session token for a user, to be handed out by whatever logs users in and sent back as "Authorization: Bearer <token>".
+
+    :param user_id: The user the token speaks for, the key of their tokens in the credential store.
+    :param ttl: Seconds the token is valid.
+    :return: The token, "<payload>.<signature>" in URL-safe base64.
+    """
+    if not secret:
+        raise InvalidSession("SESSION_SECRET is not set")
+    payload = json.dumps({"sub": user_id, "exp": int(time.time() + ttl)}, separators=(",", ":")).encode("utf-8")
+    return f"{_b64encode(payload)}.{_b64encode(_sign(payload, secret))}"
+
+
+def verify_session(token, secret=SESSION_SECRET):
+    """
+    :param token: A token from issue_session.
+    :return: The user ID it was issued for.
+    :raises InvalidSession: If the token is malformed, forged or expired, or sessions aren't configured.
+    """
+    if not secret:
+        raise InvalidSession("Sessions are not configured on this server")
+    try:
+        payload_part, signature_part = token.split(".")
+        payload, signature = _b64decode(payload_part), _b64decode(signature_part)
+    except (ValueError, binascii.Error):
+        raise InvalidSession("Malformed session token")
+    if not hmac.compare_digest(signature, _sign(payload, secret)):
+        raise InvalidSession("Invalid session token")
+    claims = json.loads(payload)
+    if claims.get("exp", 0) < time.time():
+        raise InvalidSession("Session expired")
+    return claims["sub"]
+
+
+# Mint a token by hand, e.g. for the local default user: SESSION_SECRET=... python user_auth.py default
+if __name__ == "__main__":
+    print(issue_session(sys.argv[1]))